@@ -10,6 +10,9 @@ const api = axios.create({
   },
 })
 
+// List endpoints are paginated ({ count, next, previous, results })
+const unwrapResults = (data: any) => (Array.isArray(data) ? data : data.results)
+
 // Trip Endpoints
 export const getTrip = async (tripId: string) => {
   const response = await api.get(`/trips/${tripId}/`)
@@ -18,7 +21,7 @@ export const getTrip = async (tripId: string) => {
 
 export const getTripsList = async () => {
     const response = await api.get("/trips/")
-    return response.data
+    return unwrapResults(response.data)
 }
 
 export const createTrip = async (tripData: any) => {
@@ -38,8 +41,8 @@ export const deleteTrip = async (tripId: string) => {
 
 // Stop Endpoints
 export const getStops = async (tripId: string) => {
-  const response = await api.get(`/stops/?trip=${tripId}`)
-  return response.data
+  const response = await api.get(`/stops/?trip=${tripId}&page_size=1000`)
+  return unwrapResults(response.data)
 }
 
 export const createStop = async (tripId: string, stopData: any) => {
@@ -50,8 +53,8 @@ export const createStop = async (tripId: string, stopData: any) => {
 
 // Log Entry Endpoints
 export const getLogs = async (tripId: string) => {
-  const response = await api.get(`/log-entries/?trip=${tripId}`)
-  return response.data
+  const response = await api.get(`/log-entries/?trip=${tripId}&page_size=1000`)
+  return unwrapResults(response.data)
 }
 
 export const generateLogs = async (tripId: string) => {
@@ -59,6 +62,12 @@ export const generateLogs = async (tripId: string) => {
   return response.data
 }
 
+// Previews the HOS schedule without saving logs
+export const previewLogs = async (tripId: string, overrides: any = {}) => {
+  const response = await api.post(`/trips/${tripId}/preview-logs/`, overrides)
+  return response.data
+}
+
 // Route Calculation
 export const calculateRoute = async (tripId: string) => {
   try {
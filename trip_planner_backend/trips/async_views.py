@@ -0,0 +1,62 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from trips.models import Trip
+from trips.serializers import JobSerializer
+from trips.services import jobs, planning
+from trips.services.planning import PlanningError
+
+# Async handlers for the Mapbox-bound trip actions, routed in place of the
+# TripViewSet actions when settings.ASYNC_VIEWS is on (run the project under ASGI)
+
+
+async def get_trip(pk):
+    return await Trip.objects.filter(pk=pk).afirst()
+
+
+def wants_async(request):
+    return request.GET.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+async def enqueue_job(request, trip, kind):
+    """Queues a planning job and answers 202 with the job to poll"""
+    job = await sync_to_async(jobs.enqueue)(trip, kind)
+    data = await sync_to_async(lambda: JobSerializer(job).data)()
+    response = JsonResponse(data, status=202)
+    response['Location'] = request.build_absolute_uri(reverse('job-detail', args=[job.pk]))
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def calculate_route(request, pk):
+    """Async version of POST /api/trips/{trip_id}/calculate-route/"""
+    trip = await get_trip(pk)
+    if trip is None:
+        return JsonResponse({"detail": "No Trip matches the given query."}, status=404)
+    if wants_async(request):
+        return await enqueue_job(request, trip, 'calculate_route')
+    try:
+        return JsonResponse(await planning.calculate_route_async(trip))
+    except PlanningError as e:
+        return JsonResponse(e.payload, status=e.status_code)
+
+
+@csrf_exempt
+@require_POST
+async def generate_logs(request, pk):
+    """Async version of POST /api/trips/{trip_id}/generate-logs/
+    Log generation makes no network calls, so the work runs in the sync thread
+    while the event loop keeps serving other requests"""
+    trip = await get_trip(pk)
+    if trip is None:
+        return JsonResponse({"detail": "No Trip matches the given query."}, status=404)
+    if wants_async(request):
+        return await enqueue_job(request, trip, 'generate_logs')
+    try:
+        return JsonResponse(await sync_to_async(planning.generate_logs)(trip))
+    except PlanningError as e:
+        return JsonResponse(e.payload, status=e.status_code)
@@ -0,0 +1,144 @@
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371000
+
+
+def to_array(coordinates):
+    """Converts a sequence of [lng, lat] pairs into an (n, 2) float array"""
+    return np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+
+
+def haversine(coords1, coords2):
+    """Calculates the haversine distance in meters between matching [lng, lat] rows
+    of two arrays. Either argument may be a single pair, which is broadcast"""
+    lon1, lat1 = np.radians(np.asarray(coords1, dtype=np.float64)).T
+    lon2, lat2 = np.radians(np.asarray(coords2, dtype=np.float64)).T
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def segment_lengths(coordinates):
+    """Returns the length in meters of each segment of a [lng, lat] polyline"""
+    coords = to_array(coordinates)
+    if len(coords) < 2:
+        return np.zeros(0)
+    return haversine(coords[:-1], coords[1:])
+
+
+def cumulative_lengths(coordinates):
+    """Returns the cumulative distance in meters at every vertex of a [lng, lat] polyline,
+    starting at 0 for the first vertex"""
+    lengths = segment_lengths(coordinates)
+    cumulative = np.empty(len(lengths) + 1)
+    cumulative[0] = 0.0
+    np.cumsum(lengths, out=cumulative[1:])
+    return cumulative
+
+
+def interpolate(coordinates, cumulative, fractions):
+    """Interpolates a [lng, lat] point at each fraction (0 to 1) of the polyline length.
+    Fractions outside the route are clamped to its first or last vertex"""
+    coords = to_array(coordinates)
+    cumulative = np.asarray(cumulative, dtype=np.float64)
+    targets = np.asarray(fractions, dtype=np.float64) * cumulative[-1]
+
+    # First vertex whose cumulative distance reaches the target
+    upper = np.searchsorted(cumulative, targets, side='left')
+    upper = np.clip(upper, 1, len(coords) - 1) if len(coords) > 1 else np.zeros_like(upper)
+    lower = np.maximum(upper - 1, 0)
+
+    span = cumulative[upper] - cumulative[lower]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(span > 0, (targets - cumulative[lower]) / span, 0.0)
+    t = np.clip(t, 0.0, 1.0)[:, None]
+    return coords[lower] + t * (coords[upper] - coords[lower])
+
+
+def great_circle(start, end, count):
+    """Returns count [lng, lat] points evenly spaced along the great circle from start to end
+    (both [lng, lat], included as the first and last point)"""
+    lon, lat = np.radians(np.asarray([start, end], dtype=np.float64)).T
+    # Unit vectors on the sphere
+    vectors = np.stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)), axis=1)
+    angle = np.arccos(np.clip(vectors[0] @ vectors[1], -1.0, 1.0))
+    t = np.linspace(0.0, 1.0, max(2, count))[:, None]
+    if angle < 1e-12:
+        points = vectors[0] + t * (vectors[1] - vectors[0])
+    else:
+        points = (np.sin((1 - t) * angle) * vectors[0] + np.sin(t * angle) * vectors[1]) / np.sin(angle)
+    return np.degrees(np.column_stack((np.arctan2(points[:, 1], points[:, 0]),
+                                       np.arctan2(points[:, 2], np.hypot(points[:, 0], points[:, 1])))))
+
+
+def simplify(coordinates, tolerance):
+    """Simplifies a [lng, lat] polyline with the Douglas-Peucker algorithm
+    tolerance is the largest allowed deviation in meters; the first and last points are always kept"""
+    coords = to_array(coordinates)
+    if len(coords) < 3 or tolerance <= 0:
+        return coords
+
+    # Distances are measured in meters on an equirectangular projection centered on each
+    # range's start, so the tolerance means the same thing everywhere
+    lon, lat = np.radians(coords).T
+
+    # Every pending range is split in the same vectorized pass, one tree level at a time
+    keep = np.zeros(len(coords), dtype=bool)
+    keep[0] = keep[-1] = True
+    starts = np.array([0])
+    ends = np.array([len(coords) - 1])
+    while starts.size:
+        counts = ends - starts - 1
+        has_points = counts > 0
+        starts, ends, counts = starts[has_points], ends[has_points], counts[has_points]
+        if not starts.size:
+            break
+
+        # Interior point indices of every range, laid out range after range
+        range_ids = np.repeat(np.arange(starts.size), counts)
+        offsets = np.cumsum(counts) - counts
+        points = starts[range_ids] + 1 + np.arange(counts.sum()) - offsets[range_ids]
+
+        origin, end = starts[range_ids], ends[range_ids]
+        scale = np.cos(lat[origin])
+        direction = np.column_stack(((lon[end] - lon[origin]) * scale, lat[end] - lat[origin])) * EARTH_RADIUS_METERS
+        relative = np.column_stack(((lon[points] - lon[origin]) * scale, lat[points] - lat[origin])) * EARTH_RADIUS_METERS
+        length_squared = np.einsum('ij,ij->i', direction, direction)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(length_squared > 0, np.einsum('ij,ij->i', relative, direction) / length_squared, 0.0)
+        t = np.clip(t, 0, 1)
+        offset = relative - t[:, None] * direction
+        distances = np.hypot(offset[:, 0], offset[:, 1])
+
+        # Farthest point of each range (first one on ties)
+        farthest = np.maximum.reduceat(distances, offsets)
+        is_farthest = np.flatnonzero(distances == farthest[range_ids])
+        _, first = np.unique(range_ids[is_farthest], return_index=True)
+        split_points = points[is_farthest[first]]
+
+        split = farthest > tolerance
+        split_points = split_points[split]
+        keep[split_points] = True
+        starts, ends = np.concatenate((starts[split], split_points)), np.concatenate((split_points, ends[split]))
+    return coords[keep]
+
+
+def pack_coordinates(coordinates):
+    """Packs [lng, lat] pairs into little-endian float32 bytes (8 bytes per point)"""
+    return to_array(coordinates).astype('<f4').tobytes()
+
+
+def unpack_coordinates(data):
+    """Decodes bytes from pack_coordinates into an (n, 2) float array"""
+    return np.frombuffer(data, dtype='<f4').astype(np.float64).reshape(-1, 2)
+
+
+def pack_values(values):
+    """Packs a sequence of floats into little-endian float64 bytes"""
+    return np.asarray(values, dtype='<f8').tobytes()
+
+
+def unpack_values(data):
+    """Decodes bytes from pack_values into a float array"""
+    return np.frombuffer(data, dtype='<f8')
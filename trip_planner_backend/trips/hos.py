@@ -0,0 +1,290 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+# FMCSA Hours of Service limits for property-carrying drivers
+MAX_DRIVING_HOURS = 11 # Driving allowed before a 10-hour reset
+DUTY_WINDOW_HOURS = 14 # Duty window length after coming on duty
+BREAK_AFTER_DRIVING_HOURS = 8 # Driving allowed before a 30-minute break
+CYCLE_LIMIT_HOURS = 70 # On-duty hours allowed in the 8-day cycle
+BREAK_DURATION = timedelta(minutes=30)
+RESET_DURATION = timedelta(hours=10)
+RESTART_DURATION = timedelta(hours=34) # Off-duty period that restarts the 70-hour cycle
+DEFAULT_STOP_DURATION = timedelta(minutes=30)
+
+
+@dataclass(slots=True)
+class PlannedStop:
+    """A stop to schedule, with the driving time needed to reach it from the previous stop"""
+    stop_type: str # 'pickup', 'dropoff', 'fueling' or 'rest'
+    label: str # Display name used in remarks, e.g. 'Pickup'
+    duration: timedelta | None = None # Time spent at the stop, DEFAULT_STOP_DURATION if unset
+    drive_hours: float = 0.0 # Driving hours from the previous stop (ignored for the first stop)
+
+
+@dataclass(slots=True)
+class CycleState:
+    """The driver's hours at the start of the schedule"""
+    cycle_hours: float = 0.0 # On-duty hours already used in the 70-hour/8-day cycle
+    driving_hours: float = 0.0 # Driving hours since the last 10-hour reset
+    driving_since_break: float = 0.0 # Driving hours since the last 30-minute break
+    duty_window_start: datetime | None = None # Start of the 14-hour window, defaults to the schedule start
+
+
+@dataclass(slots=True)
+class DutySegment:
+    """One duty-status period of the generated timeline"""
+    status: str # 'driving', 'on_duty', 'off_duty' or 'sleeper'
+    start: datetime
+    end: datetime
+    remarks: str = ''
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def split_at_midnight(self):
+        """Splits the segment into consecutive segments that each stay within one calendar day"""
+        parts = []
+        start = self.start
+        while True:
+            next_midnight = datetime.combine(start.date() + timedelta(days=1), datetime.min.time(), tzinfo=start.tzinfo)
+            if self.end <= next_midnight:
+                parts.append(DutySegment(self.status, start, self.end, self.remarks))
+                return parts
+            parts.append(DutySegment(self.status, start, next_midnight, self.remarks))
+            start = next_midnight
+
+
+@dataclass(slots=True)
+class Schedule:
+    """Result of build_schedule: the timeline plus the driver's hours at its end"""
+    segments: list = field(default_factory=list)
+    cycle_hours: float = 0.0
+
+    @property
+    def end(self):
+        return self.segments[-1].end if self.segments else None
+
+
+def build_schedule(stops, start_time, state=None):
+    """Simulates the driver's duty-status timeline for visiting stops in order
+    Inserts 30-minute breaks, 10-hour resets (or sleeper berth resets) and 34-hour
+    cycle restarts as the HOS limits require.
+    Args:
+        :param stops: List of PlannedStop in visiting order
+        :param start_time: datetime at which the driver starts at the first stop
+        :param state: CycleState with the driver's starting hours, fresh hours if None
+        :return: Schedule with the DutySegment timeline
+    """
+    state = state or CycleState()
+    segments = []
+    current_time = start_time
+
+    # Track driving and duty hours for HOS compliance
+    current_driving_hours = state.driving_hours # Running count of driving hours (resets after 10hr break)
+    current_duty_window_start = state.duty_window_start or current_time # Start of the 14-hour window
+    driving_since_break = state.driving_since_break # Hours driven since last 30-min break
+    cycle_hours = state.cycle_hours # For the 70 hour limit
+
+    # Initialize sleeper berth tracker
+    sleeper_tracker = SleeperBerthTracker()
+
+    for index, stop in enumerate(stops):
+        if index > 0 and stop.drive_hours > 0: # Not the first stop, and not at the same location
+            driving_time = stop.drive_hours
+
+            # Check if driver needs a 30-minute break
+            if driving_since_break + driving_time > BREAK_AFTER_DRIVING_HOURS:
+                # Insert a 30-minute break before continuing to drive
+                break_end_time = current_time + BREAK_DURATION
+                segments.append(DutySegment('off_duty', current_time, break_end_time, "Required 30-minute break after 8 hours driving"))
+                current_time = break_end_time
+                driving_since_break = 0
+
+            # Check if the leg would run past the 70-hour cycle limit
+            if cycle_hours + driving_time > CYCLE_LIMIT_HOURS:
+                restart_end_time = current_time + RESTART_DURATION
+                segments.append(DutySegment('off_duty', current_time, restart_end_time, "Required 34-hour restart (70-hour/8-day limit reached)"))
+
+                # A restart also resets the daily limits
+                current_time = restart_end_time
+                cycle_hours = 0
+                current_driving_hours = 0
+                current_duty_window_start = current_time
+                driving_since_break = 0
+
+            # Calculate hours in current duty window
+            hours_in_duty_window = (current_time - current_duty_window_start).total_seconds() / 3600
+
+            # Check if we need a rest based on hours limits or if we need to use sleeper berth provision
+            if sleeper_tracker.does_driver_need_reset(current_time, current_driving_hours, hours_in_duty_window):
+                # Driver needs either a 10-hour break or to use sleeper berth provision
+                if sleeper_tracker.get_latest_calculation_period():
+                    # We can use sleeper berth provision - reset according to rules
+                    # Note: In a real implementation, you would consider the paired periods
+                    # and recalculate more precisely as shown in the documentation
+                    current_driving_hours = 0
+                    current_duty_window_start = current_time
+                    driving_since_break = 0
+                else:
+                    # Need a full 10-hour break
+                    rest_end_time = current_time + RESET_DURATION
+                    segments.append(DutySegment('off_duty', current_time, rest_end_time, "Required 10-hour break (11-hour driving or 14-hour window limit reached)"))
+
+                    # Reset counters after 10-hour break
+                    current_time = rest_end_time
+                    current_driving_hours = 0
+                    current_duty_window_start = current_time
+                    driving_since_break = 0
+
+            # Now create the driving segment
+            driving_end_time = current_time + timedelta(hours=driving_time)
+            segments.append(DutySegment('driving', current_time, driving_end_time, f"Driving to {stop.label} stop"))
+
+            # Update counters
+            current_time = driving_end_time
+            current_driving_hours += driving_time
+            driving_since_break += driving_time
+            cycle_hours += driving_time
+
+        # Handle the stop itself
+        stop_start_time = current_time
+        stop_duration = stop.duration or DEFAULT_STOP_DURATION
+        stop_end_time = stop_start_time + stop_duration
+
+        # Determine status based on stop type
+        status = 'on_duty' # Default for pickup/dropoff/fueling
+        if stop.stop_type == 'rest':
+            # Check if this could be a sleeper berth qualifying period
+            if stop_duration >= timedelta(hours=7):
+                status = 'sleeper'
+                sleeper_tracker.add_qualifying_rest(stop_start_time, stop_end_time, 'sleeper')
+            elif stop_duration >= timedelta(hours=2):
+                status = 'off_duty'
+                sleeper_tracker.add_qualifying_rest(stop_start_time, stop_end_time, 'off_duty')
+            else:
+                status = 'off_duty'
+
+        segments.append(DutySegment(status, stop_start_time, stop_end_time, f"{stop.label} stop"))
+        current_time = stop_end_time
+
+        # On-duty time at stops counts against the cycle but not driving time
+        if status == 'on_duty':
+            cycle_hours += stop_duration.total_seconds() / 3600
+
+        # Reset counters if this was a 10+ hour break
+        if status in ['off_duty', 'sleeper'] and stop_duration >= RESET_DURATION:
+            current_driving_hours = 0
+            current_duty_window_start = current_time
+            driving_since_break = 0
+
+    return Schedule(segments=segments, cycle_hours=cycle_hours)
+
+
+# Utility class to track sleeper berth
+class SleeperBerthTracker:
+    """
+    Tracks sleeper berth periods and performs calculations for HOS compliance
+    based on the sleeper berth provision in § 395.1(g)
+    """
+    __slots__ = ('qualifying_rest_periods', 'calculation_periods')
+
+    def __init__(self):
+        self.qualifying_rest_periods = []
+        self.calculation_periods = []
+        
+    def add_qualifying_rest(self, start_time, end_time, rest_type):
+        """
+        Adds a qualifying rest period to the tracker
+        
+        Parameters:
+        start_time (datetime): Start time of the rest period
+        end_time (datetime): End time of the rest period
+        rest_type (str): Type of rest ('sleeper' or 'off_duty')
+        """
+        duration = (end_time - start_time).total_seconds() / 3600  # Duration in hours
+        
+        # Check if this is a qualifying rest period
+        if rest_type == 'sleeper' and duration >= 7:
+            self.qualifying_rest_periods.append({
+                'start': start_time,
+                'end': end_time,
+                'duration': duration,
+                'type': 'sleeper_7_plus'
+            })
+        elif (rest_type == 'sleeper' or rest_type == 'off_duty') and duration >= 2:
+            self.qualifying_rest_periods.append({
+                'start': start_time,
+                'end': end_time,
+                'duration': duration,
+                'type': 'rest_2_plus'
+            })
+            
+        # Sort periods by start time
+        self.qualifying_rest_periods.sort(key=lambda x: x['start'])
+        
+        # Find pairs and update calculation periods
+        self._update_calculation_periods()
+        
+    def _update_calculation_periods(self):
+        """
+        Updates calculation periods based on qualifying rest periods
+        Looks for valid pairs according to the sleeper berth provision
+        """
+        self.calculation_periods = []
+        
+        # We need at least 2 qualifying periods to form a pair
+        if len(self.qualifying_rest_periods) < 2:
+            return
+            
+        # Check each potential pair of rest periods
+        for i in range(len(self.qualifying_rest_periods) - 1):
+            period1 = self.qualifying_rest_periods[i]
+            
+            for j in range(i + 1, len(self.qualifying_rest_periods)):
+                period2 = self.qualifying_rest_periods[j]
+                
+                # Check if they form a valid pair according to sleeper berth provision
+                # One period must be at least 7 hours in sleeper berth
+                # Combined periods must total at least 10 hours
+                if (period1['type'] == 'sleeper_7_plus' or period2['type'] == 'sleeper_7_plus') and \
+                   (period1['duration'] + period2['duration'] >= 10):
+                    
+                    # Create a calculation period
+                    calc_period = {
+                        'first_break': period1,
+                        'second_break': period2,
+                        'calculation_start': period1['end'],
+                        'calculation_end': period2['start']
+                    }
+                    
+                    self.calculation_periods.append(calc_period)
+        
+    def get_latest_calculation_period(self):
+        """Returns the most recent calculation period or None if no valid pairs exist"""
+        if self.calculation_periods:
+            return self.calculation_periods[-1]
+        return None
+    
+    def does_driver_need_reset(self, current_time, driving_hours, duty_window_hours):
+        """
+        Determines if a driver needs a reset based on the calculation periods and current hour status
+        
+        Parameters:
+        current_time (datetime): Current time
+        driving_hours (float): Cumulative driving hours since last reset
+        duty_window_hours (float): Hours since start of duty window
+        
+        Returns:
+        bool: True if driver needs a full 10-hour reset, False otherwise
+        """
+        # Get the latest calculation period
+        calc_period = self.get_latest_calculation_period()
+        
+        # If no valid calculation period exists, use standard rules
+        if calc_period is None:
+            return driving_hours >= 11 or duty_window_hours >= 14
+            
+        # If we have a valid calculation period, we need to check if we're over the limits
+        # for the time since the end of the first rest period to the start of the second
+        return driving_hours >= 11 or duty_window_hours >= 14
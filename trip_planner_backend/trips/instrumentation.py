@@ -0,0 +1,236 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+request_logger = logging.getLogger('trips.requests')
+
+# Seconds; shared by every duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Every metric, in the order they are rendered
+REGISTRY = []
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """Process-wide counter with labels, rendered in the Prometheus text format"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    """Process-wide histogram with labels and fixed buckets, rendered in the Prometheus text format"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {} # labels -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, key)} {counts[-1]}"
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+HTTP_REQUESTS = Counter('trips_http_requests_total', "HTTP requests handled", ('method', 'route', 'status'))
+HTTP_REQUEST_DURATION = Histogram('trips_http_request_duration_seconds', "Time spent handling HTTP requests", ('method', 'route'))
+DB_QUERIES = Counter('trips_db_queries_total', "Database queries run while handling HTTP requests", ('route',))
+DB_QUERY_DURATION = Counter('trips_db_query_duration_seconds_total', "Time spent in database queries while handling HTTP requests", ('route',))
+EXTERNAL_CALLS = Counter('trips_external_calls_total', "Calls to routing and geocoding providers", ('service', 'endpoint', 'outcome'))
+EXTERNAL_CALL_DURATION = Histogram('trips_external_call_duration_seconds', "Latency of routing and geocoding provider calls", ('service', 'endpoint'))
+CACHE_LOOKUPS = Counter('trips_cache_lookups_total', "Route and geocode cache lookups", ('cache', 'result'))
+PHASE_DURATION = Histogram('trips_phase_duration_seconds', "Time spent in trip planning phases", ('phase',))
+
+
+class RequestMetrics:
+    """What one request spent its time on; filled in by the hooks below while it is current"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.external_calls = {} # "service:endpoint" -> {"count": ..., "errors": ..., "time": ...}
+        self.cache_lookups = {} # "cache:result" -> count
+        self.phases = {} # phase -> seconds
+        self._lock = threading.Lock() # Geocoding worker threads report into the same request
+
+    def add_query(self, duration):
+        with self._lock:
+            self.db_queries += 1
+            self.db_time += duration
+
+    def add_external_call(self, service, endpoint, duration, failed):
+        with self._lock:
+            call = self.external_calls.setdefault(f"{service}:{endpoint}", {"count": 0, "errors": 0, "time": 0.0})
+            call["count"] += 1
+            call["errors"] += int(failed)
+            call["time"] += duration
+
+    def add_cache_lookup(self, cache, result):
+        with self._lock:
+            key = f"{cache}:{result}"
+            self.cache_lookups[key] = self.cache_lookups.get(key, 0) + 1
+
+    def add_phase(self, name, duration):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def current():
+    """The RequestMetrics of the request being handled, or None outside requests"""
+    return _current.get()
+
+
+def start_request():
+    """Makes a fresh RequestMetrics current; returns (metrics, token for finish_request)"""
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def finish_request(token, request, response):
+    """Updates the process-wide metrics and logs the request as one JSON line"""
+    metrics = _current.get()
+    _current.reset(token)
+    duration = time.perf_counter() - metrics.started
+    match = getattr(request, 'resolver_match', None)
+    route = (match.view_name or match.route) if match else 'unmatched'
+    status = response.status_code if response is not None else 500
+
+    HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+    HTTP_REQUEST_DURATION.observe(duration, method=request.method, route=route)
+    DB_QUERIES.inc(metrics.db_queries, route=route)
+    DB_QUERY_DURATION.inc(metrics.db_time, route=route)
+
+    request_logger.info(json.dumps({
+        "method": request.method,
+        "path": request.path,
+        "route": route,
+        "status": status,
+        "duration_ms": round(duration * 1000, 2),
+        "db_queries": metrics.db_queries,
+        "db_time_ms": round(metrics.db_time * 1000, 2),
+        "external_calls": {
+            key: {"count": call["count"], "errors": call["errors"], "time_ms": round(call["time"] * 1000, 2)}
+            for key, call in metrics.external_calls.items()
+        },
+        "cache_lookups": metrics.cache_lookups,
+        "phases_ms": {name: round(seconds * 1000, 2) for name, seconds in metrics.phases.items()},
+    }))
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper timing every query of the current request (installed in TripsConfig.ready)"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(time.perf_counter() - started)
+
+
+class ExternalCall:
+    """Handle yielded by external_call; set failed when the call returned an error instead of raising"""
+    failed = False
+
+
+@contextmanager
+def external_call(service, endpoint):
+    """Times a routing or geocoding provider call; an exception counts as a failure"""
+    call = ExternalCall()
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.failed = True
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        EXTERNAL_CALLS.inc(service=service, endpoint=endpoint, outcome='error' if call.failed else 'ok')
+        EXTERNAL_CALL_DURATION.observe(duration, service=service, endpoint=endpoint)
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_external_call(service, endpoint, duration, call.failed)
+
+
+def cache_lookup(cache, hit):
+    """Counts a cache hit or miss"""
+    result = 'hit' if hit else 'miss'
+    CACHE_LOOKUPS.inc(cache=cache, result=result)
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_cache_lookup(cache, result)
+
+
+@contextmanager
+def phase(name):
+    """Times a planning phase (routing, stop_generation, log_generation, serialization)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        PHASE_DURATION.observe(duration, phase=name)
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_phase(name, duration)
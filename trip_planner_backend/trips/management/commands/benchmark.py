@@ -0,0 +1,184 @@
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+
+from trips.models import Trip
+from trips.services.local_provider import LocalProvider
+from trips.services.planning import save_route
+
+# Origin of every synthetic trip; destinations lie due east of it
+ORIGIN = (36.0, -115.0)
+METERS_PER_DEGREE = 111320
+
+
+class Command(BaseCommand):
+    help = ("Seeds a scratch test database with synthetic trips and measures wall time, query count and "
+            "peak memory of the trips API hot paths, optionally writing the results as JSON")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lengths', type=int, nargs='+', default=[300, 1200, 2800], help="Trip lengths in miles")
+        parser.add_argument('--spacings', type=float, nargs='+', default=[50, 250, 1000],
+                            help="Meters between route geometry points")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs of each benchmark")
+        parser.add_argument('--list-trips', type=int, default=200, help="Trips seeded for the list benchmarks")
+        parser.add_argument('--output', help="Write the results as JSON to this file ('-' for stdout)")
+        parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        # Throwaway database and the offline provider, so nothing real is touched or called
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(ROUTING_PROVIDER='local', LOCAL_PROVIDER_LATENCY=0, LOCAL_PROVIDER_JITTER=0,
+                                   ALLOWED_HOSTS=['*']):
+                results = self.run_benchmarks(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {"meta": self.describe_run(options), "results": results}
+        baseline = self.load_baseline(options['baseline']) if options['baseline'] else {}
+        self.print_table(results, baseline)
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def run_benchmarks(self, options):
+        repeat = options['repeat']
+        client = APIClient()
+        rng = random.Random(0)
+        results = []
+        for miles in options['lengths']:
+            for spacing in options['spacings']:
+                trip = self.seed_trip(miles, spacing)
+                case = {"miles": miles, "point_spacing": spacing, "route_points": len(trip.route.get_coordinates())}
+                benchmarks = {
+                    'generate_stops': trip.generate_stops,
+                    'calculate_location_along_route': lambda: trip.calculate_location_along_route(rng.random()),
+                    'generate_log_entries_detailed': trip.generate_log_entries_detailed,
+                    'validate_trip': lambda: self.get(client, f'/api/trips/{trip.id}/validate/'),
+                    'trip_detail': lambda: self.get(client, f'/api/trips/{trip.id}/'),
+                    'route_detail': lambda: self.get(client, f'/api/routes/{trip.route.id}/'),
+                }
+                for name, run in benchmarks.items():
+                    results.append(self.measure(name, case, run, repeat))
+
+        # List pages over a mix of the trip shapes
+        for _ in range(options['list_trips']):
+            trip = self.seed_trip(rng.choice(options['lengths']), rng.choice(options['spacings']))
+            trip.generate_log_entries_detailed()
+        case = {"trips": Trip.objects.count()}
+        results.append(self.measure('trip_list', case, lambda: self.get(client, '/api/trips/'), repeat))
+        results.append(self.measure('trip_list_summary', case, lambda: self.get(client, '/api/trips/?fields=id,status'), repeat))
+        return results
+
+    def seed_trip(self, miles, spacing):
+        """Creates a trip of about the given length with a synthesized route and its stops"""
+        lat, lng = ORIGIN
+        degrees = miles * 1609.34 / (METERS_PER_DEGREE * 1.05) / math.cos(math.radians(lat))
+        destination = (lat + 1.0, lng + degrees)
+        pickup = (lat + 0.3, lng + degrees / 3)
+        trip = Trip.objects.create(
+            current_location=self.location(ORIGIN),
+            pickup_location=self.location(pickup),
+            dropoff_location=self.location(destination),
+            current_cycle_hours=10,
+        )
+        route_data = LocalProvider(point_spacing=spacing, latency=0, jitter=0).build_route(ORIGIN, destination, [pickup])
+        save_route(trip, route_data)
+        trip.generate_stops()
+        return trip
+
+    def location(self, point):
+        return {"address": "Benchmark", "coordinates": {"lat": point[0], "lng": point[1]}}
+
+    def get(self, client, path):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise Exception(f"GET {path} returned {response.status_code}")
+        return response.content
+
+    def measure(self, name, case, run, repeat):
+        """Runs the benchmark once to warm caches, once counting queries, repeat times for timing
+        and once under tracemalloc"""
+        run()
+        # Counted with a wrapper: queries_log is reset at the start of every test client request
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, params, many, context: queries.append(sql) or execute(sql, params, many, context)):
+            run()
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+
+        # Tracing slows everything down, so memory is measured on a separate run
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        timings_ms = [timing * 1000 for timing in timings]
+        return {
+            "name": name,
+            "case": case,
+            "repeat": repeat,
+            "wall_ms": {
+                "min": min(timings_ms),
+                "median": statistics.median(timings_ms),
+                "mean": statistics.fmean(timings_ms),
+                "max": max(timings_ms),
+            },
+            "queries": len(queries),
+            "peak_memory_kb": peak / 1024,
+        }
+
+    def describe_run(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+        except OSError:
+            commit = ''
+        return {
+            "timestamp": now().isoformat(),
+            "commit": commit or None,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "options": {key: options[key] for key in ('lengths', 'spacings', 'repeat', 'list_trips')},
+        }
+
+    def load_baseline(self, path):
+        """Returns {(name, case): result} from an earlier JSON report"""
+        with open(path) as f:
+            return {self.result_key(result): result for result in json.load(f)['results']}
+
+    def result_key(self, result):
+        return result['name'], json.dumps(result['case'], sort_keys=True)
+
+    def print_table(self, results, baseline):
+        header = f"{'benchmark':<32} {'case':<40} {'median ms':>10} {'queries':>8} {'peak kb':>10}"
+        self.stdout.write(header + (f" {'vs base':>8}" if baseline else ''))
+        for result in results:
+            case = ' '.join(f"{key}={value}" for key, value in result['case'].items())
+            line = (f"{result['name']:<32} {case:<40} {result['wall_ms']['median']:>10.2f} "
+                    f"{result['queries']:>8} {result['peak_memory_kb']:>10.1f}")
+            previous = baseline.get(self.result_key(result))
+            if previous:
+                line += f" {result['wall_ms']['median'] / previous['wall_ms']['median']:>7.2f}x"
+            self.stdout.write(line)
@@ -0,0 +1,108 @@
+import random
+import time
+from datetime import date, time as clock, timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+# Schema states compared: before and after the access-pattern indexes
+BEFORE_MIGRATION = '0010_job'
+AFTER_MIGRATION = '0011_stop_log_trip_indexes'
+
+SEED_BATCH_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = ("Seeds a scratch test database and compares the query plans and timings of the hot "
+            "trip/stop/log queries before and after the indexes of migration 0011")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int, default=100000, help="Trips to seed")
+        parser.add_argument('--stops-per-trip', type=int, default=6)
+        parser.add_argument('--logs-per-trip', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=200, help="Runs of each query (each with a random trip)")
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        # Work on a throwaway test database so the real data is never touched
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            call_command('migrate', 'trips', BEFORE_MIGRATION, verbosity=0)
+            started = time.perf_counter()
+            apps = self.historical_apps(BEFORE_MIGRATION)
+            trip_ids = self.seed(apps, options['trips'], options['stops_per_trip'], options['logs_per_trip'])
+            self.stdout.write(f"Seeded {len(trip_ids)} trips in {time.perf_counter() - started:.1f}s")
+
+            rng = random.Random(0)
+            sample = [rng.choice(trip_ids) for _ in range(options['repeat'])]
+            before = self.measure(apps, sample)
+            call_command('migrate', 'trips', AFTER_MIGRATION, verbosity=0)
+            after = self.measure(self.historical_apps(AFTER_MIGRATION), sample)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f"{'query':<32} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+        for name, (before_ms, before_plan) in before.items():
+            after_ms, after_plan = after[name]
+            speedup = before_ms / after_ms if after_ms else float('inf')
+            self.stdout.write(f"{name:<32} {before_ms:>10.3f} {after_ms:>10.3f} {speedup:>7.1f}x")
+            if verbosity > 1:
+                self.stdout.write(f"  before: {before_plan}")
+                self.stdout.write(f"  after:  {after_plan}")
+
+    @staticmethod
+    def historical_apps(migration):
+        """The app registry as of a trips migration; the live models may have columns that don't exist yet"""
+        return MigrationExecutor(connection).loader.project_state(('trips', migration)).apps
+
+    def seed(self, apps, trip_count, stops_per_trip, logs_per_trip):
+        """Bulk inserts trips with stops and log entries, returning the trip ids"""
+        Trip, Stop, LogEntry = (apps.get_model('trips', name) for name in ('Trip', 'Stop', 'LogEntry'))
+        rng = random.Random(0)
+        statuses = [choice for choice, _ in Trip._meta.get_field('status').choices]
+        location = {"address": "Seed", "coordinates": {"lat": 40.0, "lng": -100.0}}
+        trip_ids = []
+        for offset in range(0, trip_count, SEED_BATCH_SIZE):
+            trips = Trip.objects.bulk_create([
+                Trip(current_location=location, pickup_location=location, dropoff_location=location,
+                     status=rng.choice(statuses))
+                for _ in range(min(SEED_BATCH_SIZE, trip_count - offset))
+            ])
+            stops, logs = [], []
+            for trip in trips:
+                for order in range(1, stops_per_trip + 1):
+                    stops.append(Stop(trip=trip, location=location, stop_type='rest', order=order,
+                                      duration=timedelta(minutes=30),
+                                      source='manual' if order % 4 == 0 else 'generated'))
+                start_date = date(2025, 1, 1) + timedelta(days=rng.randrange(365))
+                for i in range(logs_per_trip):
+                    logs.append(LogEntry(trip=trip, date=start_date + timedelta(days=i // 4), status='driving',
+                                         start_time=clock((i % 4) * 6), end_time=clock((i % 4) * 6 + 5),
+                                         duration=timedelta(hours=5)))
+            Stop.objects.bulk_create(stops)
+            LogEntry.objects.bulk_create(logs)
+            trip_ids.extend(trip.id for trip in trips)
+        return trip_ids
+
+    def measure(self, apps, sample):
+        """Returns {query name: (average milliseconds, query plan)} for the hot queries"""
+        Trip, Stop, LogEntry = (apps.get_model('trips', name) for name in ('Trip', 'Stop', 'LogEntry'))
+        log_dates = {trip_id: day for trip_id, day in LogEntry.objects.filter(trip_id__in=set(sample)).values_list('trip_id', 'date')}
+        queries = {
+            'stops for trip (ordered)': lambda trip_id: Stop.objects.filter(trip_id=trip_id).order_by('order'),
+            'generated stops for trip': lambda trip_id: Stop.objects.filter(trip_id=trip_id, source='generated').order_by().values_list('id'),
+            'log entries for trip': lambda trip_id: LogEntry.objects.filter(trip_id=trip_id).order_by('date', 'start_time'),
+            'log entries for trip day': lambda trip_id: LogEntry.objects.filter(trip_id=trip_id, date=log_dates.get(trip_id)).order_by('start_time'),
+            'trip list page': lambda trip_id: Trip.objects.order_by('-created_at')[:50],
+            'trip ids by status': lambda trip_id: Trip.objects.filter(status='in_progress').order_by().values_list('id'),
+        }
+        results = {}
+        for name, build in queries.items():
+            plan = build(sample[0]).explain().replace('\n', ' | ')
+            started = time.perf_counter()
+            for trip_id in sample:
+                list(build(trip_id))
+            results[name] = ((time.perf_counter() - started) * 1000 / len(sample), plan)
+        return results
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from trips.services import jobs
+
+
+class Command(BaseCommand):
+    help = "Runs queued trip planning jobs (use with JOB_BACKEND=database, or to drain jobs left by a restart)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the queued jobs and exit instead of polling")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait between polls when the queue is empty")
+
+    def handle(self, *args, **options):
+        count = jobs.work(poll_interval=options['poll_interval'], once=options['once'])
+        if options['once']:
+            self.stdout.write(f"Ran {count} jobs")
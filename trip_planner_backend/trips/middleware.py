@@ -0,0 +1,37 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from trips import instrumentation
+
+
+class RequestMetricsMiddleware:
+    """Collects the query, provider call, cache and phase metrics of each request
+    (see trips.instrumentation), logs them as one JSON line on the trips.requests logger
+    and adds them to the process-wide metrics served at /api/metrics/"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        _, token = instrumentation.start_request()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            instrumentation.finish_request(token, request, response)
+
+    async def __acall__(self, request):
+        _, token = instrumentation.start_request()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            instrumentation.finish_request(token, request, response)
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0004_stop_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='distance_index',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
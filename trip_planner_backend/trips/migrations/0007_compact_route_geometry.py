@@ -0,0 +1,97 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+from trips import geometry
+
+
+def split_route_data(apps, schema_editor):
+    """Moves each stored Mapbox response into the summary, packed geometry and RouteSteps"""
+    Route = apps.get_model('trips', 'Route')
+    RouteSteps = apps.get_model('trips', 'RouteSteps')
+    for route in Route.objects.all().iterator():
+        data = dict(route.route_data or {})
+        coordinates = (data.pop('geometry', None) or {}).get('coordinates')
+        legs = data.pop('legs', [])
+        route.distance = data.pop('distance', 0) or 0
+        route.duration = data.pop('duration', 0) or 0
+        route.summary = data
+        if coordinates:
+            route.geometry = geometry.pack_coordinates(coordinates)
+            route.distance_index = geometry.pack_values(
+                geometry.cumulative_lengths(geometry.unpack_coordinates(route.geometry))
+            )
+        route.save(update_fields=['distance', 'duration', 'summary', 'geometry', 'distance_index'])
+        RouteSteps.objects.create(route=route, legs=legs)
+
+
+def join_route_data(apps, schema_editor):
+    """Rebuilds the Mapbox response JSON from the compact fields"""
+    Route = apps.get_model('trips', 'Route')
+    RouteSteps = apps.get_model('trips', 'RouteSteps')
+    for route in Route.objects.all().iterator():
+        data = dict(route.summary or {})
+        data['distance'] = route.distance
+        data['duration'] = route.duration
+        coordinates = geometry.unpack_coordinates(route.geometry).tolist() if route.geometry else []
+        data['geometry'] = {"type": "LineString", "coordinates": coordinates}
+        steps = RouteSteps.objects.filter(route=route).first()
+        data['legs'] = steps.legs if steps else []
+        route.route_data = data
+        route.save(update_fields=['route_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0006_geocodecacheentry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='route',
+            name='route_data',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='distance',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='duration',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='summary',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='geometry',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RemoveField(
+            model_name='route',
+            name='distance_index',
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='distance_index',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='RouteSteps',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('legs', models.JSONField(default=list)),
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='steps', to='trips.route')),
+            ],
+        ),
+        migrations.RunPython(split_route_data, join_route_data),
+        migrations.RemoveField(
+            model_name='route',
+            name='route_data',
+        ),
+    ]
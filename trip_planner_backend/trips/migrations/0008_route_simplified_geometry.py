@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+from trips import geometry
+
+
+def build_simplified_geometries(apps, schema_editor):
+    """Precomputes the simplified geometries for existing routes"""
+    Route = apps.get_model('trips', 'Route')
+    for route in Route.objects.exclude(geometry=None).iterator():
+        coordinates = geometry.unpack_coordinates(route.geometry)
+        for detail in ('medium', 'low'):
+            tolerance = settings.ROUTE_DETAIL_TOLERANCES[detail]
+            setattr(route, f'geometry_{detail}', geometry.pack_coordinates(geometry.simplify(coordinates, tolerance)))
+        route.save(update_fields=['geometry_medium', 'geometry_low'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0007_compact_route_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='geometry_low',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='geometry_medium',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(build_simplified_geometries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:22
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renumber_duplicate_stop_orders(apps, schema_editor):
+    """Renumbers the stops of trips that have several stops with the same order, keeping their sequence"""
+    Stop = apps.get_model('trips', 'Stop')
+    trip_ids = (
+        Stop.objects.values('trip_id', 'order').annotate(rows=Count('id')).filter(rows__gt=1)
+        .values_list('trip_id', flat=True).distinct()
+    )
+    for trip_id in set(trip_ids):
+        stops = list(Stop.objects.filter(trip_id=trip_id).order_by('order', 'id'))
+        for order, stop in enumerate(stops, start=1):
+            stop.order = order
+        Stop.objects.bulk_update(stops, ['order'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0010_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['trip', 'date', 'start_time'], name='trips_logen_trip_id_4f3bf9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stop',
+            index=models.Index(fields=['trip', 'source'], name='trips_stop_trip_id_61e1b6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['created_at'], name='trips_trip_created_b7c7fb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['status'], name='trips_trip_status_259ca6_idx'),
+        ),
+        migrations.RunPython(renumber_duplicate_stop_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='stop',
+            constraint=models.UniqueConstraint(fields=('trip', 'order'), name='unique_stop_order_per_trip'),
+        ),
+    ]
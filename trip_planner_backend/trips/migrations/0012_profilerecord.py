@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0011_stop_log_trip_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('action', models.CharField(max_length=50)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('mode', models.CharField(choices=[('cprofile', 'cProfile'), ('sampling', 'Sampling')], max_length=20)),
+                ('trigger', models.CharField(choices=[('requested', 'Requested'), ('slow', 'Slow Request')], max_length=20)),
+                ('duration', models.FloatField()),
+                ('summary', models.TextField(blank=True)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='profiles', to='trips.trip')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0012_profilerecord'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='geocodecacheentry',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:48
+
+from django.db import migrations, models
+
+
+def mark_existing_entries_generated(apps, schema_editor):
+    """Entries saved before this migration were all replaced on regeneration, so they keep that behavior"""
+    LogEntry = apps.get_model('trips', 'LogEntry')
+    LogEntry.objects.update(source='generated')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0013_geocode_cache_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='logentry',
+            name='source',
+            field=models.CharField(choices=[('generated', 'Generated'), ('manual', 'Manual')], default='manual', max_length=10),
+        ),
+        migrations.RunPython(mark_existing_entries_generated, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-17 01:05
+
+from django.conf import settings
+from django.db import migrations
+
+from trips import geometry
+
+
+def rebuild_simplified_geometries(apps, schema_editor):
+    """Recomputes the simplified geometries, which were built with a projection that could drop
+    points farther off the route than the detail level's tolerance"""
+    Route = apps.get_model('trips', 'Route')
+    for route in Route.objects.exclude(geometry=None).iterator():
+        coordinates = geometry.unpack_coordinates(route.geometry)
+        for detail in ('medium', 'low'):
+            tolerance = settings.ROUTE_DETAIL_TOLERANCES[detail]
+            setattr(route, f'geometry_{detail}', geometry.pack_coordinates(geometry.simplify(coordinates, tolerance)))
+        route.save(update_fields=['geometry_medium', 'geometry_low'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0014_logentry_source'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_simplified_geometries, migrations.RunPython.noop),
+    ]
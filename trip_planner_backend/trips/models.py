@@ -1,23 +1,82 @@
+import weakref
+from dataclasses import dataclass
+from django.conf import settings
 from django.db import models, transaction
+from django.db.models import Max
 from django.core.exceptions import ValidationError
 from django.utils.timezone import now
 from datetime import timedelta, datetime, time
-import math
-from trips.services.mapbox_service import get_address_from_coordinates
+from itertools import count
+from trips import geometry, hos
+from trips.hos import SleeperBerthTracker # Re-exported for existing imports
+from trips.services.mapbox_service import ADDRESS_NOT_FOUND, get_addresses_from_coordinates
 
 def haversine_distance(coord1, coord2):
-    """Calculates the distance between two sets of coordinates in miles"""
-    # Convert decimal degrees to radians
-    lon1, lat1 = map(math.radians, coord1)
-    lon2, lat2 = map(math.radians, coord2)
-
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371000 # Radius of Earth in meters
-    return c * r 
+    """Calculates the distance between two [lng, lat] coordinates in meters"""
+    return float(geometry.haversine(coord1, coord2))
+
+class PendingTouches:
+    """on_commit callback bumping updated_at once for every trip touched in a transaction
+    Writes only become visible at commit, so one bump per trip per transaction is enough"""
+    def __init__(self):
+        self.trip_ids = set()
+        self.saved = set() # Trips saved in the transaction; auto_now already bumped them
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        trip_ids = self.trip_ids - self.saved
+        if trip_ids:
+            Trip.objects.filter(pk__in=trip_ids).update(updated_at=now())
+
+def pending_touches():
+    """Returns the PendingTouches of the current transaction, registering it on first use,
+    or None outside a transaction"""
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+    # Only a weak reference is kept on the connection: Django drops the callback when the
+    # transaction (or the savepoint it was registered in) rolls back, which frees it, and
+    # the next touch registers a fresh one
+    reference = getattr(connection, 'trip_touches', None)
+    touches = reference() if reference is not None else None
+    if touches is None or touches.done:
+        touches = PendingTouches()
+        transaction.on_commit(touches)
+        connection.trip_touches = weakref.ref(touches)
+    return touches
+
+def touch_trip(trip_id):
+    """Bumps the trip's updated_at so conditional GETs see changes to its stops, logs and route
+    Intended for every stop, log entry and route write. In autocommit mode the trip is updated
+    right away; inside a transaction the bump is deferred to commit and done once per trip"""
+    touches = pending_touches()
+    if touches is None:
+        Trip.objects.filter(pk=trip_id).update(updated_at=now())
+    else:
+        touches.trip_ids.add(trip_id)
+
+def resolve_stop_addresses(stops):
+    """Reverse geocodes, in one batch, the stops whose location has no address yet"""
+    pending = [stop for stop in stops if stop.location.get('address') is None]
+    if pending:
+        addresses = get_addresses_from_coordinates([stop.location['coordinates'] for stop in pending])
+        for stop, address in zip(pending, addresses):
+            stop.location['address'] = address
+    return stops
+
+@dataclass(slots=True)
+class StopChanges:
+    """Difference between a trip's saved generated stops and a new stop plan (see Trip.diff_generated_stops)"""
+    stops: list # The plan in route order: kept saved stops and unsaved new ones
+    created: list # Unsaved stops to insert
+    updated: list # Kept stops whose location changed or whose address is to be looked up again
+    deleted: list # Saved stops that are no longer in the plan
+
+    @property
+    def unresolved(self):
+        """New and kept stops without an address, to geocode before Trip.apply_stop_changes"""
+        return [stop for stop in (*self.created, *self.updated) if stop.location.get('address') is None]
 
 # Trip Model
 class Trip(models.Model):
@@ -37,21 +96,123 @@ class Trip(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']), # Trip lists are ordered by -created_at
+            models.Index(fields=['status']),
+        ]
+
     def __str__(self):
         return f"Trip from {self.pickup_location['address']} to {self.dropoff_location['address']}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # updated_at was just bumped, so touches later in the same transaction can be skipped
+        touches = pending_touches()
+        if touches is not None:
+            touches.saved.add(self.pk)
+
     def generate_stops(self):
         """Based on distance and regulations, generates fueling and rest stops
         --inserts a 1 hour pickup stop at the pickup location
         --inserts a 1 hour dropoff stop at the dropoff location
         --inserts fueling stops every 1000 miles
-        -- inserts a 30 minute rest stop every 8 hours"""
+        -- inserts a 30 minute rest stop every 8 hours
+        Saved generated stops that still fit the plan are kept (see diff_generated_stops),
+        so only new stops (and kept ones whose lookup failed before) are geocoded"""
+        changes = self.plan_stop_changes()
+        resolve_stop_addresses(changes.unresolved)
+        return self.apply_stop_changes(changes)
+
+    def plan_stop_changes(self):
+        """Builds the stop plan and diffs it against the saved generated stops, without geocoding
+        Shared by generate_stops and the async planning path; geocode changes.unresolved,
+        then pass the changes to apply_stop_changes"""
+        return self.diff_generated_stops(self.build_stops(resolve_addresses=False))
+
+    def diff_generated_stops(self, stops, tolerance=None):
+        """Matches planned stops (unsaved, from build_stops) against the saved generated stops
+        Pickup and dropoff stops match by type. Fueling and rest stops match, in route order, the
+        next saved stop of the same type within tolerance meters (settings.STOP_MATCH_TOLERANCE).
+        Matched stops keep their id, address and status; pickup and dropoff take the new location.
+        A kept stop holding the ADDRESS_NOT_FOUND placeholder gets its address cleared for another lookup"""
+        if tolerance is None:
+            tolerance = getattr(settings, 'STOP_MATCH_TOLERANCE', 2000)
+        saved = {}
+        for stop in Stop.objects.filter(trip=self, source='generated').order_by('order'):
+            saved.setdefault(stop.stop_type, []).append(stop)
+
+        planned, created, updated = [], [], []
+        next_index = {} # Per type, the first saved stop not passed yet
+        for stop in stops:
+            candidates = saved.get(stop.stop_type, [])
+            match = None
+            for i in range(next_index.get(stop.stop_type, 0), len(candidates)):
+                if stop.stop_type in ('pickup', 'dropoff') or self.stop_distance(candidates[i], stop) <= tolerance:
+                    match = candidates[i]
+                    next_index[stop.stop_type] = i + 1
+                    break
+            if match is None:
+                created.append(stop)
+                planned.append(stop)
+                continue
+            if stop.stop_type in ('pickup', 'dropoff') and match.location != stop.location:
+                match.location = stop.location
+                updated.append(match)
+            elif match.location.get('address') in (None, ADDRESS_NOT_FOUND):
+                match.location = {**match.location, 'address': None}
+                updated.append(match)
+            planned.append(match)
+
+        kept = {stop.pk for stop in planned if stop.pk is not None}
+        deleted = [stop for group in saved.values() for stop in group if stop.pk not in kept]
+        return StopChanges(stops=planned, created=created, updated=updated, deleted=deleted)
+
+    def stop_distance(self, stop1, stop2):
+        """Distance in meters between two stops' coordinates"""
+        coordinates1, coordinates2 = stop1.location['coordinates'], stop2.location['coordinates']
+        return haversine_distance([coordinates1['lng'], coordinates1['lat']], [coordinates2['lng'], coordinates2['lat']])
+
+    def apply_stop_changes(self, changes):
+        """Writes a StopChanges in a single transaction, touching only the rows that changed
+        Manual stops keep their order; the generated stops take the free order numbers, in sequence
+        Returns the generated stops in order"""
+        with transaction.atomic():
+            if changes.deleted:
+                Stop.objects.filter(pk__in=[stop.pk for stop in changes.deleted]).delete()
+            taken = set(Stop.objects.filter(trip=self).exclude(source='generated').values_list('order', flat=True))
+            free_orders = (order for order in count(1) if order not in taken)
+            moved = {}
+            for stop in changes.stops:
+                order = next(free_orders)
+                if stop.pk is None:
+                    stop.order = order
+                elif stop.order != order:
+                    moved[stop] = order
+
+            if moved:
+                # Park the moved stops above every used order first, so (trip, order) stays unique at each step
+                top = max(Stop.objects.filter(trip=self).aggregate(top=Max('order'))['top'] or 0, *moved.values())
+                for i, stop in enumerate(moved, start=1):
+                    stop.order = top + i
+                Stop.objects.bulk_update(list(moved), ['order'])
+                for stop, order in moved.items():
+                    stop.order = order
+            changed = list(dict.fromkeys([*moved, *changes.updated]))
+            if changed:
+                Stop.objects.bulk_update(changed, ['location', 'order'])
+            if changes.created:
+                Stop.objects.bulk_create(changes.created)
+            if changes.deleted or changed or changes.created:
+                touch_trip(self.pk)
+        return changes.stops
+
+    def build_stops(self, resolve_addresses=True):
+        """Builds the generated stops without saving them (see generate_stops)
+        With resolve_addresses=False the fueling and rest stop addresses are left as None
+        so a caller planning many trips can geocode them all at once"""
         # Business logic for automatic stop generation
 
-        
-        # Delete existing generated stops
-        Stop.objects.filter(trip=self, source='generated').delete()
-
         stops = []
         order = 1 #To order steps sequentially
 
@@ -67,38 +228,40 @@ class Trip(models.Model):
         order += 1
 
         # Fueling stops every 1000 miles
+        fueling_fractions = []
         if self.estimated_distance:
-            miles_driven = 0
-            cumulative_miles = 0
             for i in range(1, int(self.estimated_distance // 1000) + 1):
                 miles_needed = i * 1000
-                fraction = miles_needed / self.estimated_distance
-                fueling_location = self.calculate_location_along_route(fraction)
-                stops.append(Stop(
-                    trip=self,
-                    location=fueling_location,
-                    stop_type='fueling',
-                    order=order,
-                    source='generated'
-                ))
-                order += 1
-        
+                fueling_fractions.append(miles_needed / self.estimated_distance)
+
         # Rest stops every 8 hours
+        rest_fractions = []
         if self.estimated_duration:
-            hours_driven = 0
-            cumulative_hours = 0
             for i in range(1, int(self.estimated_duration // 8) + 1):
                 hours_needed = i * 8
-                fraction = hours_needed / self.estimated_duration
-                rest_location = self.calculate_location_along_route(fraction)
-                stops.append(Stop(
-                    trip=self,
-                    location=rest_location,
-                    stop_type='rest',
-                    order=order,
-                    source='generated'
-                ))
-                order += 1
+                rest_fractions.append(hours_needed / self.estimated_duration)
+
+        # Resolve every stop location in a single pass over the route index
+        locations = self.calculate_locations_along_route(fueling_fractions + rest_fractions, resolve_addresses)
+        for fueling_location in locations[:len(fueling_fractions)]:
+            stops.append(Stop(
+                trip=self,
+                location=fueling_location,
+                stop_type='fueling',
+                order=order,
+                source='generated'
+            ))
+            order += 1
+
+        for rest_location in locations[len(fueling_fractions):]:
+            stops.append(Stop(
+                trip=self,
+                location=rest_location,
+                stop_type='rest',
+                order=order,
+                source='generated'
+            ))
+            order += 1
         
         # Dropoff stop
         stops.append(Stop(
@@ -114,55 +277,31 @@ class Trip(models.Model):
         # Validate stops before saving
         self.validate_stop_schedule(stops)
 
-        with transaction.atomic():
-            for stop in stops:
-                stop.save()
+        for stop in stops:
+            stop.compute_duration()
         return stops
+
     def calculate_location_along_route(self, fraction):
         """interpolates location along the route based on the fraction provided.
         Fraction should be between 0 and 1
-        Uses route data geometry stored in self.route.route_data"""
-        if not hasattr(self, 'route') or not self.route.route_data:
+        Uses the route geometry stored in self.route"""
+        return self.calculate_locations_along_route([fraction])[0]
+
+    def calculate_locations_along_route(self, fractions, resolve_addresses=True):
+        """interpolates a location for each fraction provided, in the same order.
+        Uses the route's precomputed cumulative distance index so each lookup
+        is a binary search instead of a walk over the whole geometry"""
+        if not fractions:
+            return []
+        if not hasattr(self, 'route') or not self.route.geometry:
             raise Exception("Route data not found for trip")
-        route_data = self.route.route_data
-        # Expecting route_data['geometry']['coordinates'] to be a list of coordinates
-        coordinates = route_data.get('geometry', {}).get('coordinates')
-        if not coordinates:
-            raise Exception("Route coordinates not found in route data")
-        
-        # Calculate total distance of route
-        total_length = 0
-        distances = []
-        for i in range(1, len(coordinates)):
-            d = haversine_distance(coordinates[i-1], coordinates[i])
-            distances.append(d)
-            total_length += d
-        
-        target_distance = fraction * total_length
-        cumulative = 0
-        for i, segment_length in enumerate(distances):
-            if cumulative + segment_length >= target_distance:
-                # Interpolate between coordinates[i] and coordinates[i+1]
-                remainder = target_distance - cumulative
-                t = remainder / segment_length
-                lng1, lat1 = coordinates[i]
-                lng2, lat2 = coordinates[i+1]
-                interp_lng = lng1 + t * (lng2 - lng1)
-                interp_lat = lat1 + t * (lat2 - lat1)
-                address = get_address_from_coordinates({"lat": interp_lat, "lng": interp_lng})
-                return {
-                    "address": address,
-                    "coordinates": {"lat": interp_lat, "lng": interp_lng}
-                }
-            cumulative += segment_length
-        # Fallback return last coordinate incase target_distance is not exactly hit
-        lng, lat = coordinates[-1]
-        address = get_address_from_coordinates({"lat": lat, "lng": lng})
-        return {
-            "address": address,
-            "coordinates": {"lat": lat, "lng": lng}
-        }
-
+        coordinates_list = [{"lat": lat, "lng": lng} for lat, lng in self.route.interpolate(fractions)]
+        # Addresses are resolved concurrently once every stop position is known
+        addresses = get_addresses_from_coordinates(coordinates_list) if resolve_addresses else [None] * len(coordinates_list)
+        return [
+            {"address": address, "coordinates": coordinates}
+            for address, coordinates in zip(addresses, coordinates_list)
+        ]
 
     def validate_stop_schedule(self, stops):
         """validates stops according to HOS regulations"""
@@ -170,164 +309,64 @@ class Trip(models.Model):
 
     def estimate_driving_time(self, location1, location2):
         """Estimates driving time in hours between two locations using haversine distance."""
-        coord1 = location1['coordinates']['lng'], location1['coordinates']['lat']
-        coord2 = location2['coordinates']['lng'], location2['coordinates']['lat']
-        distance_meters = haversine_distance(coord1, coord2)
+        return float(self.estimate_driving_times([location1, location2])[0])
+
+    def estimate_driving_times(self, locations):
+        """Estimates driving time in hours for each leg between consecutive locations,
+        computed in one vectorized pass over all of them"""
+        points = [(location['coordinates']['lng'], location['coordinates']['lat']) for location in locations]
+        distances_meters = geometry.segment_lengths(points)
         # Estimate driving time based on an average speed of 60 mph (96.56 km/h)
-        driving_time_hours = distance_meters / 96560
-        return driving_time_hours
+        return distances_meters / 96560
+
+    def build_log_schedule(self, stops=None, start_time=None, cycle_hours=None):
+        """Runs the HOS scheduling engine over the trip's stops without touching the database
+        Returns a trips.hos.Schedule; stops, start_time and cycle_hours default to the trip's own"""
+        if stops is None:
+            stops = list(self.stops.order_by('order'))
+        # Driving time for every leg between consecutive stops
+        leg_driving_times = [0.0] + self.estimate_driving_times([stop.location for stop in stops]).tolist()
+        planned_stops = [
+            hos.PlannedStop(
+                stop_type=stop.stop_type,
+                label=stop.get_stop_type_display(),
+                duration=stop.duration,
+                drive_hours=drive_hours,
+            )
+            for stop, drive_hours in zip(stops, leg_driving_times)
+        ]
+        state = hos.CycleState(cycle_hours=self.current_cycle_hours if cycle_hours is None else cycle_hours)
+        return hos.build_schedule(planned_stops, start_time or self.created_at, state)
 
     def generate_log_entries_detailed(self):
         """Generate daily log entries for the trip with HOS compliance including sleeper berth provision"""
+        return self.replace_log_entries(self.build_log_entries_detailed())
+
+    def build_log_entries_detailed(self, stops=None):
+        """Builds the detailed log entries without saving them (see generate_log_entries_detailed)"""
+        schedule = self.build_log_schedule(stops)
         logs = []
-        stops = list(self.stops.order_by('order'))
-        current_time = self.created_at
-        
-        # Track driving and duty hours for HOS compliance
-        current_driving_hours = 0  # Running count of driving hours (resets after 10hr break)
-        current_duty_window_start = current_time  # Start of the 14-hour window
-        driving_since_break = 0  # Hours driven since last 30-min break
-        
-        # Weekly hour tracking
-        weekly_duty_hours = 0  # For 60/70 hour limit
-        weekly_tracking_days = []  # Track last 7/8 days of duty hours
-        
-        # Initialize sleeper berth tracker
-        sleeper_tracker = SleeperBerthTracker()
-        
-        for stop in stops:
-            # Calculate driving time to the next stop
-            if stop.order > 1:  # Not the first stop
-                prev_stop = stops[stop.order - 2]  # Adjust for 0-indexing
-                # Calculate driving time based on locations
-                driving_time = self.estimate_driving_time(prev_stop.location, stop.location)
-                
-                # Check if driver needs a 30-minute break
-                if driving_since_break + driving_time > 8:
-                    # Insert a 30-minute break before continuing to drive
-                    break_start_time = current_time
-                    break_end_time = break_start_time + timedelta(minutes=30)
-                    break_log = LogEntry(
-                        trip=self,
-                        date=break_start_time.date(),
-                        status='off_duty',  # Could also be 'on_duty' or 'sleeper'
-                        start_time=break_start_time.time(),
-                        end_time=break_end_time.time(),
-                        remarks="Required 30-minute break after 8 hours driving"
-                    )
-                    break_log.save()
-                    logs.append(break_log)
-                    current_time = break_end_time
-                    driving_since_break = 0
-                
-                # Calculate hours in current duty window
-                hours_in_duty_window = (current_time - current_duty_window_start).total_seconds() / 3600
-                
-                # Check if we need a rest based on hours limits or if we need to use sleeper berth provision
-                if sleeper_tracker.does_driver_need_reset(current_time, current_driving_hours, hours_in_duty_window):
-                    # Driver needs either a 10-hour break or to use sleeper berth provision
-                    
-                    # Determine if we can use an existing sleeper berth calculation period
-                    calc_period = sleeper_tracker.get_latest_calculation_period()
-                    
-                    if calc_period:
-                        # We can use sleeper berth provision - reset according to rules
-                        # After completing a valid sleeper berth pairing, recalculate available hours
-                        current_driving_hours = 0
-                        current_duty_window_start = current_time
-                        driving_since_break = 0
-                        
-                        # Note: In a real implementation, you would consider the paired periods
-                        # and recalculate more precisely as shown in the documentation
-                        remarks = "Hours reset using sleeper berth provision"
-                    else:
-                        # Need a full 10-hour break
-                        rest_start_time = current_time
-                        rest_end_time = rest_start_time + timedelta(hours=10)
-                        rest_log = LogEntry(
-                            trip=self,
-                            date=rest_start_time.date(),
-                            status='off_duty',  # Could also use sleeper berth
-                            start_time=rest_start_time.time(),
-                            end_time=rest_end_time.time(),
-                            remarks="Required 10-hour break (11-hour driving or 14-hour window limit reached)"
-                        )
-                        rest_log.save()
-                        logs.append(rest_log)
-                        
-                        # Reset counters after 10-hour break
-                        current_time = rest_end_time
-                        current_driving_hours = 0
-                        current_duty_window_start = current_time
-                        driving_since_break = 0
-                
-                # Now create the driving segment
-                driving_end_time = current_time + timedelta(hours=driving_time)
-                driving_log = LogEntry(
+        for segment in schedule.segments:
+            # A log entry can only span up to 24 hours, so longer periods (34-hour restarts) are split by day
+            parts = segment.split_at_midnight() if segment.duration >= timedelta(hours=24) else [segment]
+            for part in parts:
+                logs.append(LogEntry(
                     trip=self,
-                    date=current_time.date(),
-                    status='driving',
-                    start_time=current_time.time(),
-                    end_time=driving_end_time.time(),
-                    remarks=f"Driving to {stop.get_stop_type_display()} stop"
-                )
-                driving_log.save()
-                logs.append(driving_log)
-                
-                # Update counters
-                current_time = driving_end_time
-                current_driving_hours += driving_time
-                driving_since_break += driving_time
-                weekly_duty_hours += driving_time
-            
-            # Handle the stop itself
-            stop_start_time = current_time
-            stop_duration = stop.duration or timedelta(minutes=30)  # Default to 30 minutes
-            stop_end_time = stop_start_time + stop_duration
-            
-            # Determine status based on stop type
-            status = 'on_duty'  # Default for pickup/dropoff/fueling
-            if stop.stop_type == 'rest':
-                # Check if this could be a sleeper berth qualifying period
-                if stop_duration >= timedelta(hours=7):
-                    status = 'sleeper'
-                    # Track this as a potential sleeper berth qualifying period
-                    sleeper_tracker.add_qualifying_rest(stop_start_time, stop_end_time, 'sleeper')
-                elif stop_duration >= timedelta(hours=2):
-                    status = 'off_duty'
-                    # Track this as a potential qualifying rest period
-                    sleeper_tracker.add_qualifying_rest(stop_start_time, stop_end_time, 'off_duty')
-                else:
-                    status = 'off_duty'
-            
-            stop_log = LogEntry(
-                trip=self,
-                date=stop_start_time.date(),
-                status=status,
-                start_time=stop_start_time.time(),
-                end_time=stop_end_time.time(),
-                remarks=f"{stop.get_stop_type_display()} stop"
-            )
-            stop_log.save()
-            logs.append(stop_log)
-            
-            # Update current time
-            current_time = stop_end_time
-            
-            # On-duty time at stops counts against 14-hour window but not driving time
-            if status == 'on_duty':
-                weekly_duty_hours += stop_duration.total_seconds() / 3600
-            
-            # Reset counters if this was a 10+ hour break
-            if status in ['off_duty', 'sleeper'] and stop_duration >= timedelta(hours=10):
-                current_driving_hours = 0
-                current_duty_window_start = current_time
-                driving_since_break = 0
-        
+                    date=part.start.date(),
+                    status=part.status,
+                    start_time=part.start.time(),
+                    end_time=part.end.time(),
+                    remarks=part.remarks,
+                    source='generated'
+                ))
         return logs
-    
+
     def generate_log_entries(self):
         """generates simpler log generation without stops"""
+        return self.replace_log_entries(self.build_log_entries())
+
+    def build_log_entries(self):
+        """Builds the simple log entries without saving them (see generate_log_entries)"""
         logs = []
         if not self.estimated_duration:
             raise Exception("Estimated duration not found for trip")
@@ -347,9 +386,9 @@ class Trip(models.Model):
                 status='driving',
                 start_time=driving_start.time(),
                 end_time=driving_end.time(),
-                remarks="Driving segment"
+                remarks="Driving segment",
+                source='generated'
             )
-            d_log.save()
             day_logs.append(d_log)
             if day < day_count - 1:
                 off_start = driving_end
@@ -360,9 +399,9 @@ class Trip(models.Model):
                     status='off_duty',
                     start_time=off_start.time(),
                     end_time=off_end.time(),
-                    remarks="Mandatory off-duty"
+                    remarks="Mandatory off-duty",
+                    source='generated'
                 )
-                off_log.save()
                 day_logs.append(off_log)
                 on_hours = 24 - driving_hours - 10
                 on_start = off_end
@@ -373,9 +412,9 @@ class Trip(models.Model):
                     status='on_duty',
                     start_time=on_start.time(),
                     end_time=on_end.time(),
-                    remarks="On-duty"
+                    remarks="On-duty",
+                    source='generated'
                 )
-                on_log.save()
                 day_logs.append(on_log)
             else:
                 assigned = driving_hours
@@ -384,19 +423,31 @@ class Trip(models.Model):
                 on_end = on_start + timedelta(hours=on_hours)
                 on_log = LogEntry(
                     trip=self,
-                    date=current_day_start.time(),
+                    date=current_day_start.date(),
                     status='on_duty',
                     start_time=on_start.time(),
                     end_time=on_end.time(),
-                    remarks="On duty period (last day)"
+                    remarks="On duty period (last day)",
+                    source='generated'
                 )
-                on_log.save()
                 day_logs.append(on_log)
             logs.extend(day_logs)
             remaining_hours -= 24
             current_day_start += timedelta(days=1)
         return logs
 
+    def replace_log_entries(self, logs):
+        """Replaces the trip's generated log entries with the given unsaved ones
+        using one bulk delete and one bulk insert in a single transaction
+        Entries added by hand (source='manual') are kept"""
+        for log in logs:
+            log.compute_duration()
+        with transaction.atomic():
+            self.log_entries.filter(source='generated').delete()
+            LogEntry.objects.bulk_create(logs)
+            touch_trip(self.pk)
+        return logs
+
 # Stop Model
 class Stop(models.Model):
     STOP_TYPES = [
@@ -423,20 +474,56 @@ class Stop(models.Model):
     source = models.CharField(max_length=10, choices=[('generated', 'Generated'), ('manual', 'Manual')], default='manual')
 
     def save(self, *args, **kwargs):
+        self.compute_duration()
+        super().save(*args, **kwargs)
+        touch_trip(self.trip_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        touch_trip(self.trip_id)
+        return result
+
+    def compute_duration(self):
+        """Sets duration from arrival/departure times, defaulting fueling and rest stops to 30 minutes
+        save() calls this; call it directly before bulk_create"""
         if self.arrival_time and self.departure_time:
             self.duration = self.departure_time - self.arrival_time
         elif not self.duration and self.stop_type in ['fueling', 'rest']:
             self.duration = timedelta(minutes=30)
-        super().save(*args, **kwargs)
 
     class Meta:
         ordering = ['order']
+        constraints = [
+            # Also serves as the (trip, order) index for ordered stop lookups
+            models.UniqueConstraint(fields=['trip', 'order'], name='unique_stop_order_per_trip'),
+        ]
+        indexes = [
+            models.Index(fields=['trip', 'source']), # Generated stops are replaced by (trip, source)
+        ]
 
     def __str__(self):
         return f"{self.get_stop_type_display()} stop at {self.location['address']}"
 
 # LogEntry Model
 
+class LogEntryQuerySet(models.QuerySet):
+    def daily_totals(self):
+        """Computes per-day totals for each status in a single grouped aggregate query
+        Returns {date: {'status_durations': ..., 'total_day_duration': ..., 'total_work_duration': ...}}"""
+        rows = self.order_by().values('date', 'status').annotate(total=models.Sum('duration'))
+        totals = {}
+        for row in rows:
+            day = totals.setdefault(row['date'], {status: timedelta() for status, _ in LogEntry.STATUS_CHOICES})
+            day[row['status']] = row['total'] or timedelta()
+        return {
+            log_date: {
+                'status_durations': status_durations,
+                'total_day_duration': sum(status_durations.values(), timedelta()),
+                'total_work_duration': status_durations['driving'] + status_durations['on_duty'],
+            }
+            for log_date, status_durations in sorted(totals.items())
+        }
+
 class LogEntry(models.Model):
     STATUS_CHOICES = [
         ('driving', 'Driving'),
@@ -452,6 +539,12 @@ class LogEntry(models.Model):
     end_time = models.TimeField()
     duration = models.DurationField(editable=False) # Auto-computed based on start and end time
     remarks = models.TextField(null=True, blank=True)
+    source = models.CharField(max_length=10, choices=[('generated', 'Generated'), ('manual', 'Manual')], default='manual')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trip', 'date', 'start_time']), # Daily logs and totals per trip
+        ]
 
     def clean(self):
         """Validates that start_time is before end_time"""
@@ -459,150 +552,247 @@ class LogEntry(models.Model):
             raise ValidationError("Start time must be before end time")
     
     def save(self, *args, **kwargs):
+        self.compute_duration()
+        super().save(*args, **kwargs)
+        touch_trip(self.trip_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        touch_trip(self.trip_id)
+        return result
+
+    def compute_duration(self):
+        """Sets duration from start and end time, treating an earlier end time as the next day
+        save() calls this; call it directly before bulk_create"""
         start_dt = datetime.combine(self.date, self.start_time)
         end_dt = datetime.combine(self.date, self.end_time)
         if end_dt < start_dt:
             end_dt += timedelta(days=1)
         self.duration = end_dt - start_dt
-        super().save(*args, **kwargs)
     
+    objects = LogEntryQuerySet.as_manager()
+
     @classmethod
     def compute_daily_totals(cls, trip, log_date):
         """Computes total time spent on each status choice for the day"""
-        logs = cls.objects.filter(trip=trip, date=log_date)
-        status_durations = {
-            'driving': timedelta(),
-            'off_duty': timedelta(),
-            'sleeper': timedelta(),
-            'on_duty': timedelta(),
-        }
-
-        for log in logs:
-            status_durations[log.status] += log.duration
-
-        total_day_duration = sum(status_durations.values(), timedelta())
-        total_work_duration = status_durations['driving'] + status_durations['on_duty']
-
-        return {
-            'status_durations': status_durations,
-            'total_day_duration': total_day_duration,
-            'total_work_duration': total_work_duration,
-        }
+        totals = cls.objects.filter(trip=trip, date=log_date).daily_totals()
+        return totals.get(log_date, {
+            'status_durations': {status: timedelta() for status, _ in cls.STATUS_CHOICES},
+            'total_day_duration': timedelta(),
+            'total_work_duration': timedelta(),
+        })
     def __str__(self):
         return f"Log Entry on {self.date}: {self.get_status_display()} ({self.duration})"
 
 # Route Model
 class Route(models.Model):
+    """Route geometry and summary from the Mapbox Directions API
+    The geometry is stored packed (see trips.geometry.pack_coordinates) and the turn-by-turn
+    legs live in RouteSteps, so loading a route for interpolation never parses the full
+    response. route_data rebuilds the original response shape for API clients."""
     trip = models.OneToOneField(Trip, related_name="route", on_delete=models.CASCADE)
-    route_data = models.JSONField() # Stores Mapbox API response
+    distance = models.FloatField(default=0) # Distance in meters
+    duration = models.FloatField(default=0) # Duration in seconds
+    summary = models.JSONField(default=dict, blank=True) # Remaining top-level fields of the Mapbox route (weight, weight_name...)
+    geometry = models.BinaryField(null=True, blank=True) # Packed float32 [lng, lat] pairs
+    geometry_medium = models.BinaryField(null=True, blank=True) # Simplified geometry for map display (ROUTE_DETAIL_TOLERANCES)
+    geometry_low = models.BinaryField(null=True, blank=True) # Coarsest simplified geometry for overview maps
+    distance_index = models.BinaryField(null=True, blank=True, editable=False) # Packed float64 cumulative distance in meters at each coordinate
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True) # Route version for ETag/Last-Modified
+
+    def __init__(self, *args, **kwargs):
+        self._pending_legs = None
+        super().__init__(*args, **kwargs)
+
+    DETAIL_LEVELS = ('low', 'medium', 'full')
+
+    @property
+    def route_data(self):
+        """The route in Mapbox Directions response shape (geometry as GeoJSON, legs included)"""
+        return self.get_route_data()
+
+    def get_route_data(self, detail='full'):
+        """The route in Mapbox Directions response shape at the given detail level
+        'low' and 'medium' use the simplified geometry and leave out the legs"""
+        data = dict(self.summary or {})
+        data['distance'] = self.distance
+        data['duration'] = self.duration
+        data['geometry'] = {
+            "type": "LineString",
+            "coordinates": self.get_coordinates(detail).tolist() if self.geometry else [],
+        }
+        if detail == 'full':
+            data['legs'] = self.get_legs()
+        return data
+
+    @route_data.setter
+    def route_data(self, data):
+        """Splits a Mapbox Directions route into the summary, packed geometry and legs"""
+        data = dict(data or {}) # Copy, the route may be shared with the route cache
+        coordinates = (data.pop('geometry', None) or {}).get('coordinates')
+        self._pending_legs = data.pop('legs', [])
+        self.distance = data.pop('distance', 0) or 0
+        self.duration = data.pop('duration', 0) or 0
+        self.summary = data
+        self.geometry = geometry.pack_coordinates(coordinates) if coordinates else None
+        self.distance_index = None
+        self.geometry_medium = None
+        self.geometry_low = None
+
+    def save(self, *args, **kwargs):
+        self.build_derived_fields()
+        super().save(*args, **kwargs)
+        if self._pending_legs is not None:
+            RouteSteps.objects.update_or_create(route=self, defaults={"legs": self._pending_legs})
+            self._state.fields_cache.pop('steps', None)
+            self._pending_legs = None
+        touch_trip(self.trip_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        touch_trip(self.trip_id)
+        return result
+
+    @property
+    def version(self):
+        """Identifier that changes whenever the route is saved"""
+        return f"{int(self.updated_at.timestamp() * 1e6):x}"
+
+    def get_legs(self):
+        """Returns the route legs (with steps), loading them from RouteSteps on demand"""
+        if self._pending_legs is not None:
+            return self._pending_legs
+        try:
+            return self.steps.legs
+        except RouteSteps.DoesNotExist:
+            return []
+
+    def get_coordinates(self, detail='full'):
+        """Returns the route geometry at the given detail level as an (n, 2) array of [lng, lat]"""
+        if not self.geometry:
+            raise Exception("Route coordinates not found in route data")
+        packed = {'low': self.geometry_low, 'medium': self.geometry_medium}.get(detail) or self.geometry
+        return geometry.unpack_coordinates(packed)
+
+    def build_derived_fields(self):
+        """Computes the distance index and simplified geometries that are still missing
+        save() calls this; call it directly before bulk_create"""
+        if self.distance_index is None:
+            index = self.build_distance_index()
+            self.distance_index = geometry.pack_values(index) if index is not None else None
+        if self.geometry and (self.geometry_medium is None or self.geometry_low is None):
+            self.build_simplified_geometries()
+
+    def build_simplified_geometries(self):
+        """Precomputes the Douglas-Peucker simplified geometries for each display detail level"""
+        coordinates = geometry.unpack_coordinates(self.geometry)
+        for detail in ('medium', 'low'):
+            tolerance = settings.ROUTE_DETAIL_TOLERANCES[detail]
+            setattr(self, f'geometry_{detail}', geometry.pack_coordinates(geometry.simplify(coordinates, tolerance)))
+
+    def build_distance_index(self):
+        """Computes the cumulative haversine distance at every coordinate of the route geometry.
+        Returns None when the route has no geometry"""
+        if not self.geometry:
+            return None
+        return geometry.cumulative_lengths(self.get_coordinates())
+
+    def get_distance_index(self):
+        """Returns the cumulative distance index, backfilling it for routes saved before it existed"""
+        if not self.distance_index:
+            index = self.build_distance_index()
+            self.distance_index = geometry.pack_values(index) if index is not None else None
+            if self.pk:
+                Route.objects.filter(pk=self.pk).update(distance_index=self.distance_index)
+            return index
+        return geometry.unpack_values(self.distance_index)
+
+    def interpolate(self, fractions):
+        """Returns a (lat, lng) tuple for each fraction (0 to 1) of the route length"""
+        points = geometry.interpolate(self.get_coordinates(), self.get_distance_index(), fractions)
+        return [(lat, lng) for lng, lat in points.tolist()]
 
     def __str__(self):
         return f"Route for {self.trip}"
 
+class RouteSteps(models.Model):
+    """Turn-by-turn legs of a route, kept apart so they are only loaded when needed"""
+    route = models.OneToOneField(Route, related_name="steps", on_delete=models.CASCADE)
+    legs = models.JSONField(default=list) # Mapbox route legs including steps and maneuvers
 
-# Utility class to track sleeper berth
-class SleeperBerthTracker:
-    """
-    Tracks sleeper berth periods and performs calculations for HOS compliance
-    based on the sleeper berth provision in § 395.1(g)
-    """
-    def __init__(self):
-        self.qualifying_rest_periods = []
-        self.calculation_periods = []
-        
-    def add_qualifying_rest(self, start_time, end_time, rest_type):
-        """
-        Adds a qualifying rest period to the tracker
-        
-        Parameters:
-        start_time (datetime): Start time of the rest period
-        end_time (datetime): End time of the rest period
-        rest_type (str): Type of rest ('sleeper' or 'off_duty')
-        """
-        duration = (end_time - start_time).total_seconds() / 3600  # Duration in hours
-        
-        # Check if this is a qualifying rest period
-        if rest_type == 'sleeper' and duration >= 7:
-            self.qualifying_rest_periods.append({
-                'start': start_time,
-                'end': end_time,
-                'duration': duration,
-                'type': 'sleeper_7_plus'
-            })
-        elif (rest_type == 'sleeper' or rest_type == 'off_duty') and duration >= 2:
-            self.qualifying_rest_periods.append({
-                'start': start_time,
-                'end': end_time,
-                'duration': duration,
-                'type': 'rest_2_plus'
-            })
-            
-        # Sort periods by start time
-        self.qualifying_rest_periods.sort(key=lambda x: x['start'])
-        
-        # Find pairs and update calculation periods
-        self._update_calculation_periods()
-        
-    def _update_calculation_periods(self):
-        """
-        Updates calculation periods based on qualifying rest periods
-        Looks for valid pairs according to the sleeper berth provision
-        """
-        self.calculation_periods = []
-        
-        # We need at least 2 qualifying periods to form a pair
-        if len(self.qualifying_rest_periods) < 2:
-            return
-            
-        # Check each potential pair of rest periods
-        for i in range(len(self.qualifying_rest_periods) - 1):
-            period1 = self.qualifying_rest_periods[i]
-            
-            for j in range(i + 1, len(self.qualifying_rest_periods)):
-                period2 = self.qualifying_rest_periods[j]
-                
-                # Check if they form a valid pair according to sleeper berth provision
-                # One period must be at least 7 hours in sleeper berth
-                # Combined periods must total at least 10 hours
-                if (period1['type'] == 'sleeper_7_plus' or period2['type'] == 'sleeper_7_plus') and \
-                   (period1['duration'] + period2['duration'] >= 10):
-                    
-                    # Create a calculation period
-                    calc_period = {
-                        'first_break': period1,
-                        'second_break': period2,
-                        'calculation_start': period1['end'],
-                        'calculation_end': period2['start']
-                    }
-                    
-                    self.calculation_periods.append(calc_period)
-        
-    def get_latest_calculation_period(self):
-        """Returns the most recent calculation period or None if no valid pairs exist"""
-        if self.calculation_periods:
-            return self.calculation_periods[-1]
-        return None
-    
-    def does_driver_need_reset(self, current_time, driving_hours, duty_window_hours):
-        """
-        Determines if a driver needs a reset based on the calculation periods and current hour status
-        
-        Parameters:
-        current_time (datetime): Current time
-        driving_hours (float): Cumulative driving hours since last reset
-        duty_window_hours (float): Hours since start of duty window
-        
-        Returns:
-        bool: True if driver needs a full 10-hour reset, False otherwise
-        """
-        # Get the latest calculation period
-        calc_period = self.get_latest_calculation_period()
-        
-        # If no valid calculation period exists, use standard rules
-        if calc_period is None:
-            return driving_hours >= 11 or duty_window_hours >= 14
-            
-        # If we have a valid calculation period, we need to check if we're over the limits
-        # for the time since the end of the first rest period to the start of the second
-        return driving_hours >= 11 or duty_window_hours >= 14
+    def __str__(self):
+        return f"Steps for {self.route}"
+
+# Reverse geocoding cache
+class GeocodeCacheEntry(models.Model):
+    key = models.CharField(max_length=64, unique=True) # Coordinates rounded to GEOCODE_CACHE_PRECISION
+    lat = models.FloatField()
+    lng = models.FloatField()
+    address = models.TextField()
+    created_at = models.DateTimeField(default=now, db_index=True) # Indexed for TTL eviction
+    last_used_at = models.DateTimeField(default=now, db_index=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.address}"
+
+# Background job for slow trip planning steps
+class Job(models.Model):
+    KIND_CHOICES = [
+        ('calculate_route', 'Calculate Route'),
+        ('generate_logs', 'Generate Logs'),
+    ]
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    trip = models.ForeignKey(Trip, related_name="jobs", on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    result = models.JSONField(null=True, blank=True) # Response body of the equivalent synchronous request
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job for {self.trip} ({self.status})"
+
+
+# Profile captured for a slow or explicitly profiled trip API request
+class ProfileRecord(models.Model):
+    MODE_CHOICES = [
+        ('cprofile', 'cProfile'),
+        ('sampling', 'Sampling'),
+    ]
+
+    TRIGGER_CHOICES = [
+        ('requested', 'Requested'),
+        ('slow', 'Slow Request'),
+    ]
+
+    trip = models.ForeignKey(Trip, related_name="profiles", null=True, blank=True, on_delete=models.SET_NULL)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    action = models.CharField(max_length=50) # ViewSet action, e.g. generate_logs
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES)
+    trigger = models.CharField(max_length=20, choices=TRIGGER_CHOICES)
+    duration = models.FloatField() # Seconds spent in the view
+    summary = models.TextField(blank=True) # Top functions, readable without downloading
+    data = models.BinaryField() # pstats dump (cprofile) or collapsed stacks (sampling)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_mode_display()} profile of {self.method} {self.path} ({self.duration:.2f}s)"
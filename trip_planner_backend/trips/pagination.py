@@ -0,0 +1,9 @@
+from rest_framework.pagination import PageNumberPagination
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    """Page number pagination shared by the trips API viewsets
+    Clients can ask for a different page size with ?page_size= (up to max_page_size)"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
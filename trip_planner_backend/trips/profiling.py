@@ -0,0 +1,174 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from trips.models import ProfileRecord
+
+MODES = ('cprofile', 'sampling')
+
+
+class StackSampler:
+    """Process-wide sampling profiler
+    One daemon thread wakes every interval seconds and records the current stack of each
+    registered thread; registering a thread costs a dict insert, so it is cheap enough to
+    run for every request and keep only the slow ones"""
+    def __init__(self, interval):
+        self.interval = interval
+        self._collectors = {} # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        stacks = Counter()
+        with self._lock:
+            self._collectors[thread_id] = stacks
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, name='trip-profiler', daemon=True)
+                self._thread.start()
+        return stacks
+
+    def stop(self, thread_id):
+        """Unregisters the thread and returns a copy of its stacks that no sample can change anymore"""
+        with self._lock:
+            return Counter(self._collectors.pop(thread_id, ()))
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                collectors = dict(self._collectors)
+            if not collectors:
+                continue
+            frames = sys._current_frames()
+            samples = [(thread_id, stacks, collapse_stack(frames[thread_id])) for thread_id, stacks in collectors.items() if thread_id in frames]
+            # Counted under the lock, and only for threads still registered, so stop() never races an update
+            with self._lock:
+                for thread_id, stacks, stack in samples:
+                    if self._collectors.get(thread_id) is stacks:
+                        stacks[stack] += 1
+
+
+def collapse_stack(frame):
+    """Formats a stack root first as "file:function:line;..." (the collapsed format of flame graph tools)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        # Parent directory included, since names like base.py repeat across packages
+        filename = os.path.join(*code.co_filename.split(os.sep)[-2:])
+        names.append(f"{filename}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """Returns the process-wide StackSampler, creating it on first use"""
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = StackSampler(getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.005))
+    return _sampler
+
+
+class Profile:
+    """Profiles the calling thread between start() and stop()
+    Args:
+        :param mode: 'cprofile' traces every call (precise, slows the request down);
+            'sampling' records the stack every PROFILE_SAMPLE_INTERVAL seconds
+    """
+    def __init__(self, mode):
+        self.mode = mode
+        self.started = None
+        self.duration = None
+        self._profiler = None
+        self._stacks = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._stacks = get_sampler().start(threading.get_ident())
+        return self
+
+    def stop(self):
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+        else:
+            self._stacks = get_sampler().stop(threading.get_ident())
+        self.duration = time.perf_counter() - self.started
+        return self
+
+    def data(self):
+        """The raw profile: pstats dump (open with pstats, snakeviz...) or collapsed stacks text"""
+        if self.mode == 'cprofile':
+            self._profiler.create_stats()
+            return marshal.dumps(self._profiler.stats)
+        return '\n'.join(f"{stack} {count}" for stack, count in self._stacks.most_common()).encode()
+
+    def summary(self, limit=30):
+        """Human readable top functions by cumulative time (cprofile) or by samples (sampling)"""
+        if self.mode == 'cprofile':
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+            return out.getvalue()
+
+        # Samples in which each function is on the stack (inclusive) or running itself (self)
+        total = sum(self._stacks.values())
+        inclusive, own, depth = Counter(), Counter(), {}
+        for stack, count in self._stacks.items():
+            names = [frame.rsplit(':', 1)[0] for frame in stack.split(';')]
+            for level, name in enumerate(names):
+                depth[name] = max(depth.get(name, 0), level)
+            for name in set(names):
+                inclusive[name] += count
+            own[names[-1]] += count
+        # Among equally hot functions the deepest (most specific) comes first
+        ranked = sorted(inclusive, key=lambda name: (-inclusive[name], -depth[name]))[:limit]
+        lines = [f"{total} samples every {get_sampler().interval * 1000:g} ms", f"{'samples':>8} {'%':>6} {'self':>6}  function"]
+        lines += [f"{inclusive[name]:>8} {inclusive[name] * 100 / total:6.1f} {own[name]:>6}  {name}" for name in ranked]
+        return '\n'.join(lines)
+
+
+def requested_mode(request):
+    """Profiling mode asked for with ?profile= or the X-Profile header ("1" means cprofile)
+    Staff only; anyone else gets None"""
+    value = (request.query_params.get('profile') or request.headers.get('X-Profile') or '').lower()
+    if not value or not request.user.is_staff:
+        return None
+    if value in MODES:
+        return value
+    return 'cprofile' if value in ('1', 'true', 'yes') else None
+
+
+def store_profile(profile, request, action, trip_id, trigger, status_code):
+    """Saves the stopped profile and deletes the oldest ones beyond settings.PROFILE_MAX_RECORDS"""
+    record = ProfileRecord.objects.create(
+        trip_id=trip_id,
+        method=request.method,
+        path=request.get_full_path()[:500],
+        action=action or '',
+        status_code=status_code,
+        mode=profile.mode,
+        trigger=trigger,
+        duration=profile.duration,
+        summary=profile.summary(),
+        data=profile.data(),
+    )
+    max_records = getattr(settings, 'PROFILE_MAX_RECORDS', 200)
+    stale = ProfileRecord.objects.values_list('pk', flat=True)[max_records:]
+    ProfileRecord.objects.filter(pk__in=list(stale)).delete()
+    return record
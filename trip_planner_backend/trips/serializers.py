@@ -1,52 +1,234 @@
+from datetime import timedelta
+from django.conf import settings
 from rest_framework import serializers
-from trips.models import Stop, Trip, LogEntry, Route
+from trips.models import Stop, Trip, LogEntry, Route, Job, ProfileRecord
 
-class StopSerializer(serializers.ModelSerializer):
+LOCATION_FIELDS = ('current_location', 'pickup_location', 'dropoff_location')
+
+def find_location_error(data):
+    """Checks the trip locations in request data, which the JSON fields accept in any shape
+    Returns (field, message) for the first badly formatted location, or None"""
+    for field in LOCATION_FIELDS:
+        location_data = data.get(field)
+        if not location_data:
+            continue
+        if not isinstance(location_data, dict):
+            return field, f"Invalid format for {field}. Expected a JSON object."
+        coordinates = location_data.get('coordinates')
+        if not location_data.get('address') or not isinstance(coordinates, dict) or 'lat' not in coordinates or 'lng' not in coordinates:
+            return field, f"Invalid {field} format. Expected {{\"address\": \"...\", \"coordinates\": {{\"lat\": ..., \"lng\": ...}}}}"
+    return None
+
+class DynamicFieldsMixin:
+    """Serializer mixin for sparse fieldsets and optional expansion of related objects
+    Accepts `fields` (names to keep) and `expand` (names from expandable_fields to nest)
+    keyword arguments; views fill them from the ?fields= and ?expand= query parameters.
+    expandable_fields maps a field name to (serializer class, keyword arguments) and
+    default_expand lists the fields nested when neither fields nor expand is requested;
+    expandable names listed in fields are nested too."""
+
+    expandable_fields = {}
+    default_expand = ()
+    field_sources = {} # Non-column fields mapped to the columns and relations they read
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+
+        expanded = self.resolve_expand(expand, fields)
+        for name, (serializer_class, options) in self.expandable_fields.items():
+            if name in expanded:
+                self.fields[name] = serializer_class(**options)
+
+        if fields is not None:
+            allowed = set(fields) | expanded
+            for name in list(self.fields):
+                if name not in allowed:
+                    self.fields.pop(name)
+
+    @classmethod
+    def resolve_expand(cls, expand, fields=None):
+        """Returns the set of expandable field names to nest for the requested expansion and fields
+        A sparse fieldset only nests the expandable names it lists, never default_expand"""
+        if expand is None and fields is None:
+            return set(cls.default_expand)
+        return {name for name in (*(expand or ()), *(fields or ())) if name in cls.expandable_fields}
+
+    @classmethod
+    def get_sources(cls, fields=None):
+        """Returns the model columns and relations read by the requested fields"""
+        names = fields if fields is not None else cls.Meta.fields
+        sources = []
+        for name in names:
+            sources.extend(cls.field_sources.get(name, (name,)))
+        return sources
+
+    @classmethod
+    def setup_queryset(cls, queryset, fields=None, expand=None, required=()):
+        """Narrows the queryset to the requested columns and joins
+        Defers the columns no requested field reads (except those in required) and prefetches
+        (or joins, for one-to-one relations) exactly the expanded relations and those the requested fields read"""
+        model = queryset.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        sources = cls.get_sources(fields)
+
+        lookups = [name for name in sources if name not in concrete and name in cls._relation_names(model)]
+        for name in cls.resolve_expand(expand, fields):
+            serializer_class = cls.expandable_fields[name][0]
+            lookups.append(name)
+            lookups.extend(f"{name}__{lookup}" for lookup in serializer_class.get_sources() if lookup in cls._relation_names(model._meta.get_field(name).related_model))
+
+        for lookup in lookups:
+            if cls._is_single_relation(model, lookup):
+                queryset = queryset.select_related(lookup)
+            else:
+                queryset = queryset.prefetch_related(lookup)
+
+        if fields is not None:
+            # defer() rather than only() so joined relations keep all their columns
+            unused = concrete - set(sources) - set(required) - {model._meta.pk.name}
+            queryset = queryset.defer(*unused)
+        return queryset
+
+    @staticmethod
+    def _relation_names(model):
+        return {field.name for field in model._meta.get_fields() if field.is_relation and not field.concrete}
+
+    @staticmethod
+    def _is_single_relation(model, lookup):
+        """True when every hop of the lookup is a one-to-one or many-to-one relation"""
+        for name in lookup.split('__'):
+            field = model._meta.get_field(name)
+            if not (field.one_to_one or field.many_to_one):
+                return False
+            model = field.related_model
+        return True
+
+class StopSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for stop model"""
     class Meta:
         model = Stop
         fields = ['id', 'trip', 'location', 'stop_type', 'status', 'order', 'arrival_time', 'departure_time', 'duration', 'source']
         #read_only_fields = ['duration']
 
-class LogEntrySerializer(serializers.ModelSerializer):
+class LogEntrySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for log entry model"""
     class Meta:
         model = LogEntry
-        fields = ['id', 'trip', 'date', 'status', 'start_time', 'end_time', 'duration', 'remarks']
+        fields = ['id', 'trip', 'date', 'status', 'start_time', 'end_time', 'duration', 'remarks', 'source']
 
     def validate(self, data):
         """Ensures that the log entries for a day do not exceed 24 hours"""
-        trip = data.get('trip')
-        log_date = data.get('date')
+        # Partial updates fall back to the saved values
+        trip, log_date, start_time, end_time = (
+            data.get(name, getattr(self.instance, name, None)) for name in ('trip', 'date', 'start_time', 'end_time')
+        )
         exisiting_logs = LogEntry.objects.filter(trip=trip, date=log_date)
+        if self.instance is not None:
+            exisiting_logs = exisiting_logs.exclude(pk=self.instance.pk)
 
-        # Compute total time including new entry
-        total_duration = sum([log.duration for log in exisiting_logs], data.get('end_time') - data.get('start_time'))
+        # Compute total time including new entry (times can't be subtracted directly)
+        entry = LogEntry(date=log_date, start_time=start_time, end_time=end_time)
+        entry.compute_duration()
+        total_duration = sum([log.duration for log in exisiting_logs], entry.duration)
 
         if total_duration > timedelta(hours=24):
             raise serializers.ValidationError("Total duration for the day cannot exceed 24 hours")
 
         return data
 
-class TripSerializer(serializers.ModelSerializer):
-    """Serializer for trip model with nested stops and logs"""
+class RouteDataField(serializers.JSONField):
+    """Mapbox route JSON at the detail level in the serializer context ('low', 'medium' or 'full')"""
 
-    stops = StopSerializer(many=True, read_only=True) # Nested stops
-    log_entries = LogEntrySerializer(many=True, read_only=True) # Nested log entries
+    def get_attribute(self, instance):
+        return instance.get_route_data(self.context.get('detail', 'full'))
 
-    class Meta:
-        model = Trip
-        fields = ['id', 'current_location', 'pickup_location', 'dropoff_location', 'current_cycle_hours', 'estimated_distance', 'estimated_duration', 'status', 'created_at', 'updated_at', 'stops', 'log_entries']
-        read_only_fields = ['created_at', 'updated_at']
-
-class RouteSerializer(serializers.ModelSerializer):
+class RouteSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for route model"""
 
+    route_data = RouteDataField() # Mapbox route, stored compactly by the model
+    field_sources = {'route_data': ('distance', 'duration', 'summary', 'geometry', 'geometry_medium', 'geometry_low', 'steps')}
+
     class Meta:
         model = Route
         fields = ['id', 'trip', 'route_data', 'created_at']
         read_only_fields = ['created_at']
 
+class TripSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Serializer for trip model with nested stops and logs
+    Stops and log entries are nested unless ?expand= or ?fields= asks for something else; the route can be expanded too"""
+
+    expandable_fields = {
+        'stops': (StopSerializer, {'many': True, 'read_only': True}), # Nested stops
+        'log_entries': (LogEntrySerializer, {'many': True, 'read_only': True}), # Nested log entries
+        'route': (RouteSerializer, {'read_only': True}),
+    }
+    default_expand = ('stops', 'log_entries')
+
+    class Meta:
+        model = Trip
+        fields = ['id', 'current_location', 'pickup_location', 'dropoff_location', 'current_cycle_hours', 'estimated_distance', 'estimated_duration', 'status', 'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+
+class TripListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Compact serializer for trip lists: summary fields plus stop and log counts instead of nested rows
+    Expects the queryset to be annotated with stop_count and log_entry_count"""
+
+    expandable_fields = TripSerializer.expandable_fields
+
+    stop_count = serializers.IntegerField(read_only=True)
+    log_entry_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Trip
+        fields = ['id', 'current_location', 'pickup_location', 'dropoff_location', 'current_cycle_hours', 'estimated_distance', 'estimated_duration', 'status', 'created_at', 'updated_at', 'stop_count', 'log_entry_count']
+        read_only_fields = fields
+
+class JobSerializer(serializers.ModelSerializer):
+    """Serializer for background planning jobs"""
+
+    class Meta:
+        model = Job
+        fields = ['id', 'trip', 'kind', 'status', 'result', 'error', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+class ProfileRecordSerializer(serializers.ModelSerializer):
+    """Serializer for captured request profiles; the raw data is downloaded separately"""
+
+    class Meta:
+        model = ProfileRecord
+        fields = ['id', 'trip', 'method', 'path', 'action', 'status_code', 'mode', 'trigger', 'duration', 'summary', 'created_at']
+        read_only_fields = fields
+
+class BatchTripsSerializer(serializers.Serializer):
+    """Input for the batch planning endpoint; each trip is validated with TripSerializer"""
+    trips = serializers.ListField(child=serializers.DictField(), min_length=1, max_length=getattr(settings, 'BATCH_MAX_TRIPS', 500))
+    generate_logs = serializers.BooleanField(default=True)
+
 class GenerateLogsSerializer(serializers.Serializer):
     """Empty serializer for log generation endpoint"""
     pass
+
+class ExtraRestStopSerializer(serializers.Serializer):
+    """A rest stop to add to a schedule preview, taken at the location of an existing stop"""
+    after_order = serializers.IntegerField(min_value=0) # Order of the stop the rest is taken after (0 = before the first stop)
+    duration_hours = serializers.FloatField(min_value=0.25, max_value=34, default=0.5)
+
+class PreviewLogsSerializer(serializers.Serializer):
+    """Optional overrides for the schedule preview endpoint"""
+    start_time = serializers.DateTimeField(required=False)
+    current_cycle_hours = serializers.FloatField(required=False, min_value=0, max_value=70)
+    extra_rest_stops = ExtraRestStopSerializer(many=True, required=False)
+
+class DutySegmentSerializer(serializers.Serializer):
+    """Serializer for an in-memory duty-status segment (trips.hos.DutySegment)"""
+    date = serializers.SerializerMethodField()
+    status = serializers.CharField()
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+    duration = serializers.DurationField()
+    remarks = serializers.CharField()
+
+    def get_date(self, segment):
+        return segment.start.date()
@@ -0,0 +1,121 @@
+import itertools
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils.timezone import now
+
+from trips import instrumentation
+from trips.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# In-process front cache; the database table is shared between workers
+_memory_cache = TTLCache(
+    maxsize=getattr(settings, 'GEOCODE_MEMORY_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'GEOCODE_CACHE_TTL', None),
+)
+
+# Database writes by this process; eviction runs every GEOCODE_CACHE_EVICT_EVERY of them
+_writes = itertools.count(1)
+
+
+def bucket_key(coordinates, precision=None):
+    """Builds the cache key for coordinates by rounding them to a spatial bucket
+    precision is the number of decimal places kept (4 is roughly 11 meters)"""
+    if precision is None:
+        precision = getattr(settings, 'GEOCODE_CACHE_PRECISION', 4)
+    lat = round(float(coordinates['lat']), precision) + 0.0  # + 0.0 folds -0.0 into 0.0
+    lng = round(float(coordinates['lng']), precision) + 0.0
+    return f"{precision}:{lat:.{precision}f},{lng:.{precision}f}"
+
+
+def get_cached_address(coordinates):
+    """Returns the cached address for the coordinates' bucket, or None on a miss"""
+    key = bucket_key(coordinates)
+    address = _memory_cache.get(key)
+    instrumentation.cache_lookup('geocode_memory', address is not None)
+    if address is not None:
+        return address
+
+    address = read_entry(key)
+    instrumentation.cache_lookup('geocode_db', address is not None)
+    if address is not None:
+        _memory_cache.set(key, address)
+    return address
+
+
+def read_entry(key):
+    """Returns the address stored in the database table for the bucket, or None"""
+    from trips.models import GeocodeCacheEntry
+
+    # The cache is best effort: a busy or unavailable database just means a miss
+    try:
+        entry = GeocodeCacheEntry.objects.filter(key=key).first()
+        if entry is None:
+            return None
+        ttl = getattr(settings, 'GEOCODE_CACHE_TTL', None)
+        if ttl and entry.created_at < now() - timedelta(seconds=ttl):
+            entry.delete()
+            return None
+        # Recency only matters to eviction, so it is refreshed at most once per touch interval
+        touch_interval = getattr(settings, 'GEOCODE_CACHE_TOUCH_INTERVAL', 3600)
+        if entry.last_used_at < now() - timedelta(seconds=touch_interval):
+            GeocodeCacheEntry.objects.filter(pk=entry.pk).update(last_used_at=now())
+    except DatabaseError as e:
+        logger.warning(f"Geocode cache read failed for {key}: {e}")
+        return None
+    return entry.address
+
+
+def store_address(coordinates, address):
+    """Stores a resolved address for the coordinates' bucket
+    Every GEOCODE_CACHE_EVICT_EVERY writes also evict stale entries"""
+    from trips.models import GeocodeCacheEntry
+
+    key = bucket_key(coordinates)
+    _memory_cache.set(key, address)
+    try:
+        # A single upsert instead of update_or_create's savepoint, locking read and write
+        GeocodeCacheEntry.objects.bulk_create(
+            [GeocodeCacheEntry(key=key, lat=coordinates['lat'], lng=coordinates['lng'], address=address,
+                               created_at=now(), last_used_at=now())],
+            update_conflicts=True,
+            unique_fields=['key'],
+            update_fields=['lat', 'lng', 'address', 'created_at', 'last_used_at'],
+        )
+        if next(_writes) % max(getattr(settings, 'GEOCODE_CACHE_EVICT_EVERY', 500), 1) == 0:
+            evict_entries()
+    except DatabaseError as e:
+        logger.warning(f"Geocode cache write failed for {key}: {e}")
+
+
+def remember_address(coordinates, address):
+    """Stores an address in the in-process cache only; safe from threads that must not use the database"""
+    _memory_cache.set(bucket_key(coordinates), address)
+
+
+def evict_entries():
+    """Deletes expired entries, then the least recently used ones beyond GEOCODE_CACHE_MAX_ENTRIES"""
+    from trips.models import GeocodeCacheEntry
+
+    ttl = getattr(settings, 'GEOCODE_CACHE_TTL', None)
+    if ttl:
+        GeocodeCacheEntry.objects.filter(created_at__lt=now() - timedelta(seconds=ttl)).delete()
+
+    max_entries = getattr(settings, 'GEOCODE_CACHE_MAX_ENTRIES', None)
+    if max_entries:
+        stale_ids = GeocodeCacheEntry.objects.order_by('-last_used_at').values_list('id', flat=True)[max_entries:]
+        stale_ids = list(stale_ids)
+        if stale_ids:
+            GeocodeCacheEntry.objects.filter(id__in=stale_ids).delete()
+
+
+def clear():
+    """Empties the in-process front cache (the database table is left untouched)"""
+    _memory_cache.clear()
+
+
+def stats():
+    return _memory_cache.stats()
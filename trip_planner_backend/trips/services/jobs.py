@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils.timezone import now
+
+from trips.models import Job
+from trips.services import planning
+from trips.services.planning import PlanningError
+
+logger = logging.getLogger(__name__)
+
+# Job kind -> function taking the trip and returning the JSON result
+HANDLERS = {
+    'calculate_route': planning.calculate_route,
+    'generate_logs': planning.generate_logs,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the process-wide worker pool for the 'thread' backend, creating it on first use"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'JOB_WORKERS', 2),
+                    thread_name_prefix='trip-jobs',
+                )
+    return _executor
+
+
+def enqueue(trip, kind):
+    """Queues a job for the trip, reusing one of the same kind that is still pending
+    With JOB_BACKEND 'thread' the job runs in this process once the transaction commits;
+    with 'database' it waits for the run_jobs management command"""
+    pending = Job.objects.filter(trip=trip, kind=kind, status__in=['queued', 'running']).first()
+    if pending:
+        return pending
+
+    job = Job.objects.create(trip=trip, kind=kind)
+    if getattr(settings, 'JOB_BACKEND', 'thread') == 'thread':
+        transaction.on_commit(lambda: get_executor().submit(run_in_thread, job.pk))
+    return job
+
+
+def run_in_thread(job_id):
+    """Runs a job on a pool thread, which needs its own database connection handling"""
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        connection.close()
+
+
+def run_job(job_id):
+    """Claims the queued job and runs it, storing the result or the error
+    Returns False when another worker already claimed the job"""
+    claimed = Job.objects.filter(pk=job_id, status='queued').update(status='running', started_at=now())
+    if not claimed:
+        return False
+
+    job = Job.objects.select_related('trip').get(pk=job_id)
+    try:
+        job.result = HANDLERS[job.kind](job.trip)
+        job.status = 'succeeded'
+    except PlanningError as e:
+        job.result = e.payload
+        job.error = str(e)
+        job.status = 'failed'
+    except Exception as e:
+        logger.exception(f"Job {job.id} ({job.kind}) failed for trip {job.trip_id}: {str(e)}")
+        job.error = str(e)
+        job.status = 'failed'
+    job.finished_at = now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    return True
+
+
+def run_pending(limit=None):
+    """Runs queued jobs oldest first until none are left (or limit jobs ran)
+    Returns the number of jobs run"""
+    count = 0
+    while limit is None or count < limit:
+        job_id = Job.objects.filter(status='queued').order_by('created_at').values_list('id', flat=True).first()
+        if job_id is None:
+            break
+        if run_job(job_id):
+            count += 1
+    return count
+
+
+def requeue_stale(timeout=None):
+    """Puts jobs left running longer than timeout seconds (e.g. by a killed worker) back in the queue"""
+    timeout = timeout or getattr(settings, 'JOB_TIMEOUT', 600)
+    stale = Job.objects.filter(status='running', started_at__lt=now() - timedelta(seconds=timeout))
+    return stale.update(status='queued', started_at=None)
+
+
+def work(poll_interval=1.0, once=False):
+    """Database-backed worker loop used by the run_jobs management command"""
+    requeue_stale()
+    while True:
+        count = run_pending()
+        if once:
+            return count
+        if not count:
+            time.sleep(poll_interval)
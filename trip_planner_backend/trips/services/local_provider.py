@@ -0,0 +1,142 @@
+import asyncio
+import math
+import random
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from trips import geometry
+from trips.services.provider import RoutingProvider
+
+AVERAGE_SPEED_MPS = 24.6 # About 55 mph
+STEP_LENGTH_METERS = 50000 # Distance covered by each synthesized maneuver step
+
+STREETS = ['Main', 'Oak', 'Maple', 'Cedar', 'Pine', 'Elm', 'Washington', 'Lake', 'Hill', 'Park', 'Ridge', 'Mill']
+SUFFIXES = ['Street', 'Avenue', 'Road', 'Drive', 'Boulevard', 'Lane']
+TOWNS = ['Springfield', 'Riverside', 'Fairview', 'Franklin', 'Greenville', 'Bristol', 'Clinton', 'Madison',
+         'Georgetown', 'Salem', 'Arlington', 'Ashland', 'Dover', 'Milton', 'Newport', 'Oxford']
+STATES = ['Texas', 'Ohio', 'Kansas', 'Nevada', 'Oregon', 'Iowa', 'Utah', 'Georgia', 'Illinois', 'Colorado']
+
+
+class LocalProvider(RoutingProvider):
+    """Offline stand-in for Mapbox, for load tests and benchmarks
+    Routes follow the great circle between the points with a gentle meander, sampled every
+    point_spacing meters, and addresses are made up from the coordinates; both are
+    deterministic. Every call sleeps latency seconds plus up to jitter seconds.
+    Args:
+        :param point_spacing: Meters between geometry points, defaults to settings.LOCAL_PROVIDER_POINT_SPACING
+        :param latency: Seconds each call takes, defaults to settings.LOCAL_PROVIDER_LATENCY
+        :param jitter: Random extra seconds per call, defaults to settings.LOCAL_PROVIDER_JITTER
+    """
+    name = 'local'
+
+    def __init__(self, point_spacing=None, latency=None, jitter=None):
+        self.point_spacing = point_spacing or getattr(settings, 'LOCAL_PROVIDER_POINT_SPACING', 250)
+        self.latency = latency if latency is not None else getattr(settings, 'LOCAL_PROVIDER_LATENCY', 0)
+        self.jitter = jitter if jitter is not None else getattr(settings, 'LOCAL_PROVIDER_JITTER', 0)
+
+    def delay(self):
+        """Seconds the next call should take"""
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def get_route(self, origin, destination, waypoints=None):
+        time.sleep(self.delay())
+        return self.build_route(origin, destination, waypoints)
+
+    def reverse_geocode(self, coordinates):
+        time.sleep(self.delay())
+        return self.build_address(coordinates)
+
+    async def get_route_async(self, origin, destination, waypoints=None):
+        await asyncio.sleep(self.delay())
+        return self.build_route(origin, destination, waypoints)
+
+    async def reverse_geocode_async(self, coordinates):
+        await asyncio.sleep(self.delay())
+        return self.build_address(coordinates)
+
+    def build_route(self, origin, destination, waypoints=None):
+        """Synthesizes a route in Mapbox Directions response shape through (lat, lng) points"""
+        points = [(float(lng), float(lat)) for lat, lng in [origin, *(waypoints or []), destination]]
+        coordinates, legs = [], []
+        for start, end in zip(points[:-1], points[1:]):
+            leg_coordinates = self.build_leg_geometry(start, end)
+            lengths = geometry.segment_lengths(leg_coordinates)
+            legs.append(self.build_leg(leg_coordinates, lengths))
+            # Legs share their boundary point
+            coordinates.extend(leg_coordinates if not coordinates else leg_coordinates[1:])
+
+        distance = sum(leg['distance'] for leg in legs)
+        duration = sum(leg['duration'] for leg in legs)
+        return {
+            "distance": distance,
+            "duration": duration,
+            "weight": duration,
+            "weight_name": "auto",
+            "geometry": {"type": "LineString", "coordinates": coordinates},
+            "legs": legs,
+        }
+
+    def build_leg_geometry(self, start, end):
+        """[lng, lat] points from start to end: the great circle plus a meander that vanishes at both ends"""
+        length = float(geometry.haversine(start, end))
+        count = max(2, math.ceil(length / self.point_spacing) + 1)
+        points = geometry.great_circle(start, end, count)
+
+        # Seeded by the endpoints so the same lane always gets the same shape
+        rng = random.Random(f"{start[0]:.5f},{start[1]:.5f};{end[0]:.5f},{end[1]:.5f}")
+        t = np.linspace(0.0, 1.0, count)
+        offset = sum(rng.uniform(-1, 1) / k * np.sin(k * np.pi * t) for k in range(1, 6))
+        amplitude = min(length * 0.02, 20000) / geometry.EARTH_RADIUS_METERS # radians
+
+        # Push each point sideways, perpendicular to the start -> end direction
+        scale = np.cos(np.radians(points[:, 1]))
+        dx, dy = (end[0] - start[0]) * scale, end[1] - start[1]
+        norm = np.hypot(dx, dy)
+        if length > 0:
+            normal = np.column_stack((-dy / norm / np.maximum(scale, 1e-6), dx / norm))
+            points = points + np.degrees(amplitude) * offset[:, None] * normal
+        return np.round(points, 6).tolist()
+
+    def build_leg(self, coordinates, lengths):
+        """A Directions leg with one maneuver step every STEP_LENGTH_METERS"""
+        cumulative = np.concatenate(([0.0], np.cumsum(lengths)))
+        distance = float(cumulative[-1])
+        step_count = max(1, math.ceil(distance / STEP_LENGTH_METERS))
+        bounds = np.unique(np.searchsorted(cumulative, np.linspace(0, distance, step_count + 1)))
+        bounds[0], bounds[-1] = 0, len(coordinates) - 1
+
+        steps = []
+        for i, (first, last) in enumerate(zip(bounds[:-1], bounds[1:])):
+            step_distance = float(cumulative[last] - cumulative[first])
+            steps.append({
+                "distance": step_distance,
+                "duration": step_distance / AVERAGE_SPEED_MPS,
+                "geometry": {"type": "LineString", "coordinates": coordinates[first:last + 1]},
+                "maneuver": {"type": "depart" if i == 0 else "continue", "location": coordinates[first],
+                             "instruction": "Drive to the destination" if i == 0 else "Continue straight"},
+                "mode": "driving",
+            })
+        steps.append({
+            "distance": 0.0,
+            "duration": 0.0,
+            "geometry": {"type": "LineString", "coordinates": [coordinates[-1], coordinates[-1]]},
+            "maneuver": {"type": "arrive", "location": coordinates[-1], "instruction": "You have arrived at your destination"},
+            "mode": "driving",
+        })
+        return {
+            "distance": distance,
+            "duration": distance / AVERAGE_SPEED_MPS,
+            "weight": distance / AVERAGE_SPEED_MPS,
+            "summary": "Local route",
+            "steps": steps,
+        }
+
+    def build_address(self, coordinates):
+        """Made-up but stable address for {"lat": ..., "lng": ...} (about 100 m buckets)"""
+        seed = zlib.crc32(f"{float(coordinates['lat']):.3f},{float(coordinates['lng']):.3f}".encode())
+        rng = random.Random(seed)
+        return (f"{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(SUFFIXES)}, {rng.choice(TOWNS)}, "
+                f"{rng.choice(STATES)} {rng.randint(10000, 99999)}, United States")
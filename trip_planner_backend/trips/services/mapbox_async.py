@@ -0,0 +1,210 @@
+import asyncio
+import functools
+import logging
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from trips import instrumentation
+from trips.services import geocode_cache
+from trips.services.mapbox_client import RETRY_STATUS_CODES, RateLimiter, client_options, get_rate_limiter
+from trips.services.mapbox_service import (
+    ADDRESS_NOT_FOUND,
+    build_geocode_request,
+    build_route_request,
+    parse_geocode_response,
+    parse_route_response,
+    route_cache,
+    route_cache_key,
+)
+from trips.services.provider import get_provider
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMapboxClient:
+    """Async counterpart of MapboxClient built on httpx
+    Pools keep-alive connections, applies connect/read timeouts, retries connection errors
+    and 429/5xx responses with exponential backoff (honoring Retry-After up to
+    MAPBOX_MAX_RETRY_AFTER seconds) and rate limits requests with the limiter the sync
+    client uses. An instance belongs to the event loop it is used on."""
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff_factor=None, rate_limit=None, rate_limit_burst=None, pool_size=None,
+                 max_retry_after=None):
+        connect_timeout = connect_timeout if connect_timeout is not None else getattr(settings, 'MAPBOX_CONNECT_TIMEOUT', 3.05)
+        read_timeout = read_timeout if read_timeout is not None else getattr(settings, 'MAPBOX_READ_TIMEOUT', 10)
+        pool_size = pool_size or getattr(settings, 'MAPBOX_POOL_SIZE', 10)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'MAPBOX_MAX_RETRIES', 3)
+        self.backoff_factor = backoff_factor if backoff_factor is not None else getattr(settings, 'MAPBOX_BACKOFF_FACTOR', 0.5)
+        self.max_retry_after = max_retry_after if max_retry_after is not None else getattr(settings, 'MAPBOX_MAX_RETRY_AFTER', 30)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        # Reservations never block, so the thread-safe sync limiter works on the event loop too
+        self.rate_limiter = (
+            RateLimiter(rate_limit, rate_limit_burst or getattr(settings, 'MAPBOX_RATE_LIMIT_BURST', None))
+            if rate_limit is not None else get_rate_limiter()
+        )
+
+    async def get(self, url, params=None):
+        """Sends a rate-limited GET request, retrying transient failures, and returns the last response
+        Raises httpx.HTTPError when every attempt failed to connect or timed out"""
+        for attempt in range(self.max_retries + 1):
+            wait_seconds = self.rate_limiter.reserve()
+            if wait_seconds:
+                await asyncio.sleep(wait_seconds)
+            try:
+                response = await self.client.get(url, params=params)
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                return response
+            delay = self.backoff(attempt, response.headers.get('Retry-After'))
+            if delay is None:
+                logger.warning(f"Not retrying {url}: Retry-After of {response.headers['Retry-After']}s exceeds {self.max_retry_after:g}s")
+                return response
+            await asyncio.sleep(delay)
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before the next attempt, or None when Retry-After asks for more than max_retry_after"""
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                pass
+            else:
+                return delay if self.max_retry_after is None or delay <= self.max_retry_after else None
+        return self.backoff_factor * (2 ** attempt)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# Clients per event loop, since httpx connections cannot be shared between loops
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(purpose=None):
+    """Returns the AsyncMapboxClient for the running event loop and the purpose (see mapbox_client.client_options),
+    creating it on first use"""
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(purpose)
+    if client is None:
+        client = clients[purpose] = AsyncMapboxClient(**client_options(purpose))
+    return client
+
+
+async def get_route(origin, destination, waypoints=None):
+    """Async version of MapboxService.get_route, sharing its route cache"""
+    provider = get_provider()
+    cache_key = route_cache_key([origin, *(waypoints or []), destination], {"provider": provider.name})
+    route = route_cache.get(cache_key)
+    instrumentation.cache_lookup('route', route is not None)
+    if route is not None:
+        return route
+
+    with instrumentation.external_call(provider.name, 'directions'):
+        route = await provider.get_route_async(origin, destination, waypoints=waypoints)
+    route_cache.set(cache_key, route)
+    return route
+
+
+async def fetch_route(origin, destination, waypoints=None):
+    """Async version of mapbox_service.fetch_route (no caching)"""
+    url, params = build_route_request(origin, destination, waypoints)
+    return parse_route_response(await get_async_client().get(url, params=params))
+
+
+async def reverse_geocode(coordinates):
+    """Async version of mapbox_service.reverse_geocode (no caching)"""
+    url, params = build_geocode_request(coordinates)
+    try:
+        response = await get_async_client('geocoding').get(url, params=params)
+    except httpx.HTTPError as e:
+        logger.warning(f"Error reverse geocoding coordinates: {e}")
+        return None
+    return parse_geocode_response(response, coordinates)
+
+
+async def get_addresses_from_coordinates(coordinates_list, max_concurrency=None, timeout=None):
+    """Async version of mapbox_service.get_addresses_from_coordinates
+    Cache misses are looked up concurrently on the event loop, at most max_concurrency at a time
+    Args:
+        :param coordinates_list: List of {"lat": ..., "lng": ...} dictionaries
+        :param max_concurrency: Maximum concurrent lookups, defaults to settings.GEOCODE_MAX_WORKERS
+        :param timeout: Seconds to wait for the lookups, defaults to settings.GEOCODE_TIMEOUT;
+            nothing is waited for past it. Lookups still running then finish in the background
+            and only fill the in-process cache
+        :return: List of addresses in the same order; unfinished or failed lookups get the
+            'Address not found' placeholder
+    """
+    if max_concurrency is None:
+        max_concurrency = getattr(settings, 'GEOCODE_MAX_WORKERS', 8)
+    if timeout is None:
+        timeout = getattr(settings, 'GEOCODE_TIMEOUT', 10)
+
+    # The cache lives in the database, which is only reachable from sync code
+    addresses = await sync_to_async(lambda: [geocode_cache.get_cached_address(coordinates) for coordinates in coordinates_list])()
+    misses = {}
+    for i, coordinates in enumerate(coordinates_list):
+        if addresses[i] is None:
+            misses.setdefault(geocode_cache.bucket_key(coordinates), []).append(i)
+    if not misses:
+        return addresses
+
+    provider = get_provider()
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    started = set()
+
+    async def lookup(key, coordinates):
+        async with semaphore:
+            started.add(key)
+            with instrumentation.external_call(provider.name, 'geocoding') as call:
+                address = await provider.reverse_geocode_async(coordinates)
+                call.failed = address is None
+            return address
+
+    tasks = {key: asyncio.create_task(lookup(key, coordinates_list[indexes[0]])) for key, indexes in misses.items()}
+    await asyncio.wait(tasks.values(), timeout=timeout)
+
+    resolved = []
+    for key, task in tasks.items():
+        indexes = misses[key]
+        coordinates = coordinates_list[indexes[0]]
+        address = None
+        if not task.done():
+            logger.warning(f"get_addresses_from_coordinates - Lookup timed out for coordinates: {coordinates}")
+            if key in started:
+                # Hard deadline: the running lookup finishes in the background; the loop only keeps weak task references
+                _late_lookups.add(task)
+                task.add_done_callback(functools.partial(remember_late_address, coordinates))
+            else:
+                task.cancel()
+        elif not task.exception():
+            address = task.result()
+        if address is not None:
+            resolved.append((coordinates, address))
+        for i in indexes:
+            addresses[i] = address if address is not None else ADDRESS_NOT_FOUND
+
+    if resolved:
+        await sync_to_async(lambda: [geocode_cache.store_address(coordinates, address) for coordinates, address in resolved])()
+    return addresses
+
+
+# Lookups that outlived their deadline, referenced until they finish
+_late_lookups = set()
+
+
+def remember_late_address(coordinates, task):
+    """Done callback of a lookup that outlived the deadline: keeps its address in the in-process cache"""
+    _late_lookups.discard(task)
+    if not task.cancelled() and not task.exception() and task.result() is not None:
+        geocode_cache.remember_address(coordinates, task.result())
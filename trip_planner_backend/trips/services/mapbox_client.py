@@ -0,0 +1,147 @@
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """Thread-safe token bucket that keeps callers under a request rate
+    Shared by the sync and async clients (see get_rate_limiter): reserve() never blocks, so
+    threads sleep on it with acquire() and coroutines with asyncio.sleep
+    Args:
+        :param rate: Requests allowed per second; 0 or None disables limiting
+        :param burst: Requests that may be sent back to back before limiting kicks in
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate or 1))
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes one token, possibly ahead of time, and returns the seconds to wait before sending"""
+        if not self.rate:
+            return 0
+        with self._lock:
+            current = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (current - self._updated_at) * self.rate)
+            self._updated_at = current
+            self._tokens -= 1
+            return max(0, -self._tokens / self.rate)
+
+    def acquire(self):
+        """Takes one token, sleeping until it is due"""
+        wait_seconds = self.reserve()
+        if wait_seconds:
+            time.sleep(wait_seconds)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Returns the process-wide RateLimiter (settings.MAPBOX_RATE_LIMIT), creating it on first use
+    Sync and async requests draw from it alike, so the process stays under one rate"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter(getattr(settings, 'MAPBOX_RATE_LIMIT', 5), getattr(settings, 'MAPBOX_RATE_LIMIT_BURST', None))
+    return _rate_limiter
+
+
+class CappedRetry(Retry):
+    """Retry that gives up instead of honoring a Retry-After longer than max_retry_after seconds
+    The response asking for the wait is returned as the last one (raise_on_status=False)"""
+    def __init__(self, *args, max_retry_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retry_after = max_retry_after
+
+    def new(self, **kwargs):
+        kwargs.setdefault('max_retry_after', self.max_retry_after)
+        return super().new(**kwargs)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and self.max_retry_after is not None and self.respect_retry_after_header:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None and retry_after > self.max_retry_after:
+                raise MaxRetryError(_pool, url, ResponseError(f"Retry-After of {retry_after:g}s exceeds {self.max_retry_after:g}s"))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class MapboxClient:
+    """Shared HTTP client for Mapbox APIs
+    Reuses pooled keep-alive connections, applies connect/read timeouts, retries
+    429/5xx responses with exponential backoff (honoring Retry-After up to
+    MAPBOX_MAX_RETRY_AFTER seconds) and rate limits outgoing requests, with the shared
+    limiter unless rate_limit is given. A single instance is safe to share between threads.
+    """
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff_factor=None, rate_limit=None, rate_limit_burst=None, pool_size=None,
+                 max_retry_after=None):
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else getattr(settings, 'MAPBOX_CONNECT_TIMEOUT', 3.05),
+            read_timeout if read_timeout is not None else getattr(settings, 'MAPBOX_READ_TIMEOUT', 10),
+        )
+        retry = CappedRetry(
+            total=max_retries if max_retries is not None else getattr(settings, 'MAPBOX_MAX_RETRIES', 3),
+            backoff_factor=backoff_factor if backoff_factor is not None else getattr(settings, 'MAPBOX_BACKOFF_FACTOR', 0.5),
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset(['GET']),
+            respect_retry_after_header=True,
+            raise_on_status=False, # Hand the last response back so callers can report it
+            max_retry_after=max_retry_after if max_retry_after is not None else getattr(settings, 'MAPBOX_MAX_RETRY_AFTER', 30),
+        )
+        pool_size = pool_size or getattr(settings, 'MAPBOX_POOL_SIZE', 10)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.rate_limiter = (
+            RateLimiter(rate_limit, rate_limit_burst or getattr(settings, 'MAPBOX_RATE_LIMIT_BURST', None))
+            if rate_limit is not None else get_rate_limiter()
+        )
+
+    def get(self, url, params=None):
+        """Sends a rate-limited GET request and returns the response
+        Raises requests.exceptions.RequestException on connection errors and timeouts"""
+        self.rate_limiter.acquire()
+        return self.session.get(url, params=params, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_client_lock = threading.Lock()
+
+
+def client_options(purpose=None):
+    """MapboxClient arguments for a purpose
+    Geocoding lookups run against GEOCODE_TIMEOUT, so they retry at most MAPBOX_GEOCODE_MAX_RETRIES
+    times and never wait out a Retry-After longer than that deadline"""
+    if purpose == 'geocoding':
+        return {
+            'max_retries': getattr(settings, 'MAPBOX_GEOCODE_MAX_RETRIES', 1),
+            'max_retry_after': min(getattr(settings, 'MAPBOX_MAX_RETRY_AFTER', 30), getattr(settings, 'GEOCODE_TIMEOUT', 10)),
+        }
+    return {}
+
+
+def get_client(purpose=None):
+    """Returns the process-wide MapboxClient for the purpose (None or 'geocoding'), creating it on first use"""
+    client = _clients.get(purpose)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(purpose)
+            if client is None:
+                client = _clients[purpose] = MapboxClient(**client_options(purpose))
+    return client
@@ -0,0 +1,19 @@
+from trips.services import mapbox_async, mapbox_service
+from trips.services.provider import RoutingProvider
+
+
+class MapboxProvider(RoutingProvider):
+    """Routes and addresses from the Mapbox Directions and Geocoding APIs"""
+    name = 'mapbox'
+
+    def get_route(self, origin, destination, waypoints=None):
+        return mapbox_service.fetch_route(origin, destination, waypoints)
+
+    def reverse_geocode(self, coordinates):
+        return mapbox_service.reverse_geocode(coordinates)
+
+    async def get_route_async(self, origin, destination, waypoints=None):
+        return await mapbox_async.fetch_route(origin, destination, waypoints)
+
+    async def reverse_geocode_async(self, coordinates):
+        return await mapbox_async.reverse_geocode(coordinates)
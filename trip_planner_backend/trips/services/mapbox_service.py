@@ -1,49 +1,103 @@
+import contextvars
+import logging
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
 from django.conf import settings
 
+from trips import instrumentation
+from trips.services import geocode_cache
+from trips.services.cache import TTLCache
+from trips.services.mapbox_client import get_client
+from trips.services.provider import get_provider
+
+logger = logging.getLogger(__name__)
+
 MAPBOX_BASE_URL = "https://api.mapbox.com/directions/v5/mapbox/driving"
+MAPBOX_GEOCODING_URL = "https://api.mapbox.com/geocoding/v5/mapbox.places"
+
+# Stored in place of an address when a lookup fails; stops holding it are retried on recalculation
+ADDRESS_NOT_FOUND = 'Address not found'
+
+# Parsed routes keyed by rounded coordinates and provider
+route_cache = TTLCache(
+    maxsize=getattr(settings, 'ROUTE_CACHE_SIZE', 256),
+    ttl=getattr(settings, 'ROUTE_CACHE_TTL', 3600),
+)
+
+def route_cache_key(points, params, precision=None):
+    """Builds the route cache key from (lat, lng) points rounded to ROUTE_CACHE_PRECISION decimal places
+    and the request options (an access token is left out)"""
+    if precision is None:
+        precision = getattr(settings, 'ROUTE_CACHE_PRECISION', 4)
+    rounded = tuple((round(float(lat), precision) + 0.0, round(float(lng), precision) + 0.0) for lat, lng in points)
+    options = tuple(sorted((key, value) for key, value in params.items() if key != 'access_token'))
+    return (precision, rounded, options)
+
+def build_route_request(origin, destination, waypoints=None):
+    """Builds the Directions API request for a route
+    Returns (url, params); shared by the sync and async clients"""
+    access_token = settings.MAPBOX_API_KEY
+    if not access_token:
+        raise Exception("Mapbox API key not found/ Not configured")
+
+    # Build coordinate string: origin;waypoint1;waypoint2;destination (Mapbox expects lng,lat)
+    coords = [f"{origin[1]},{origin[0]}"]  # lng,lat
+    if waypoints:
+        coords += [f"{waypoint[1]},{waypoint[0]}" for waypoint in waypoints]  # lng,lat
+    coords.append(f"{destination[1]},{destination[0]}") # lng,lat
+    coordinates = ";".join(coords)
+
+    # Build URL parameters
+    params = {
+        "access_token": access_token,
+        "geometries": "geojson",
+        "steps": "true",
+        "overview": "full",
+    }
+    return f"{MAPBOX_BASE_URL}/{coordinates}", params
+
+def fetch_route(origin, destination, waypoints=None):
+    """Calls the Mapbox Directions API without touching the cache"""
+    url, params = build_route_request(origin, destination, waypoints)
+    return parse_route_response(get_client().get(url, params=params))
+
+def parse_route_response(response):
+    """Returns the first route of a Directions API response (requests or httpx) or raises"""
+    if response.status_code != 200:
+        raise Exception(f"Mapbox API Error: {response.status_code} {response.text}")
+
+    data = response.json()
+
+    if not data.get('routes'): # Check for 'routes' key as a string
+        raise Exception("No route for given addresses")
+    return data['routes'][0]
 
 class MapboxService:
     @staticmethod
     def get_route(origin, destination, waypoints=None):
-        """Fetches optimized route from Mapbox Directions API
+        """Fetches optimized route from the routing provider (Mapbox Directions API unless
+        settings.ROUTING_PROVIDER selects another)
         Args:
             :param origin: Tuple of (lat, lng) coordinates for origin
             :param destination: Tuple of (lat, lng) coordinates for destination
             :param waypoints: List of Tuple of (lat, lng) for intermediate stops
             :return: Dictionary with route data or raises exception if not found
         """
-        access_token = settings.MAPBOX_API_KEY
-        if not access_token:
-            raise Exception("Mapbox API key not found/ Not configured")
-        
-        # Build coordinate string: origin;waypoint1;waypoint2;destination (Mapbox expects lng,lat)
-        coords = [f"{origin[1]},{origin[0]}"]  # lng,lat
-        if waypoints:
-            coords += [f"{waypoint[1]},{waypoint[0]}" for waypoint in waypoints]  # lng,lat
-        coords.append(f"{destination[1]},{destination[0]}") # lng,lat
-        coordinates = ";".join(coords)
-
-        # Build URL parameters
-        params = {
-            "access_token": access_token,
-            "geometries": "geojson",
-            "steps": "true",
-            "overview": "full",
-        }
-
-        url = f"{MAPBOX_BASE_URL}/{coordinates}"
-        response = requests.get(url, params=params)
-        if response.status_code != 200:
-            raise Exception(f"Mapbox API Error: {response.status_code} {response.text}")
-        
-        data = response.json()
-
-        if not data.get('routes'): # Check for 'routes' key as a string
-            raise Exception("No route for given addresses")
-
-        # Return first route from response
-        return data['routes'][0]
+        provider = get_provider()
+        cache_key = route_cache_key([origin, *(waypoints or []), destination], {"provider": provider.name})
+
+        # Repeat lanes are answered from the route cache
+        route = route_cache.get(cache_key)
+        instrumentation.cache_lookup('route', route is not None)
+        if route is not None:
+            return route
+
+        # Cache and return the route (callers must not mutate it)
+        with instrumentation.external_call(provider.name, 'directions'):
+            route = provider.get_route(origin, destination, waypoints=waypoints)
+        route_cache.set(cache_key, route)
+        return route
 
 def get_coordinates(location_json):
     """Extracts lat, lng coordinates from location JSON
@@ -56,23 +110,111 @@ def get_coordinates(location_json):
         raise Exception("Invalid coordinates in location JSON; Coordinates missing")
 
 def get_address_from_coordinates(coordinates):
-    """Reverse geocodes coordinates to get address using Mapbox API"""
-    url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{coordinates['lng']},{coordinates['lat']}.json?access_token={settings.MAPBOX_API_KEY}"
+    """Reverse geocodes coordinates to get address using the routing provider
+    Results are cached per spatial bucket, so nearby coordinates share one lookup"""
+    address = geocode_cache.get_cached_address(coordinates)
+    if address is not None:
+        return address
+
+    address = lookup_address(get_provider(), coordinates)
+    if address is None:
+        return ADDRESS_NOT_FOUND
+    geocode_cache.store_address(coordinates, address)
+    return address
+
+def lookup_address(provider, coordinates):
+    """Reverse geocodes through the provider, recording the call for the request metrics"""
+    with instrumentation.external_call(provider.name, 'geocoding') as call:
+        address = provider.reverse_geocode(coordinates)
+        call.failed = address is None
+    return address
+
+def reverse_geocode(coordinates):
+    """Calls the Mapbox geocoding API without touching the cache
+    Returns the address, or None if the lookup failed or found nothing"""
+    url, params = build_geocode_request(coordinates)
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        features = data.get('features', [])
-        if features:
-            address = features[0].get('place_name', 'Address not found')
-            print(f"get_address_from_coordinates - Coordinates: {coordinates}, Address: {address}")
-            return address
-        else:
-            print(f"get_address_from_coordinates - No features found for coordinates: {coordinates}")
-            return 'Address not found'
+        response = get_client('geocoding').get(url, params=params)
     except requests.exceptions.RequestException as e:
-        print(f"Error reverse geocoding coordinates: {e}")
-        return 'Address not found'
-    print(f"get_address_from_coordinates called with coordinates: {coordinates}")
-    print(f"Mapbox API URL: {url}")
-    print(f"Mapbox API response: {response.text}")
+        logger.warning(f"Error reverse geocoding coordinates: {e}")
+        return None
+    return parse_geocode_response(response, coordinates)
+
+def build_geocode_request(coordinates):
+    """Builds the reverse geocoding request, returning (url, params)"""
+    url = f"{MAPBOX_GEOCODING_URL}/{coordinates['lng']},{coordinates['lat']}.json"
+    return url, {"access_token": settings.MAPBOX_API_KEY}
+
+def parse_geocode_response(response, coordinates):
+    """Returns the address from a reverse geocoding response (requests or httpx), or None"""
+    if response.status_code != 200:
+        logger.warning(f"Error reverse geocoding coordinates: {response.status_code} {response.text}")
+        return None
+    data = response.json()
+    features = data.get('features', [])
+    if features:
+        address = features[0].get('place_name', ADDRESS_NOT_FOUND)
+        logger.debug(f"get_address_from_coordinates - Coordinates: {coordinates}, Address: {address}")
+        return address
+    else:
+        logger.info(f"get_address_from_coordinates - No features found for coordinates: {coordinates}")
+        return None
+
+def get_addresses_from_coordinates(coordinates_list, max_workers=None, timeout=None):
+    """Reverse geocodes many coordinates, running the cache misses concurrently through a bounded thread pool
+    Args:
+        :param coordinates_list: List of {"lat": ..., "lng": ...} dictionaries
+        :param max_workers: Maximum concurrent lookups, defaults to settings.GEOCODE_MAX_WORKERS
+        :param timeout: Seconds to wait for the lookups, defaults to settings.GEOCODE_TIMEOUT;
+            nothing is waited for past it. Lookups still running then finish in the background
+            and only fill the in-process cache, so retrying the placeholders usually hits it
+        :return: List of addresses in the same order; unfinished or failed lookups get the
+            'Address not found' placeholder
+    """
+    if max_workers is None:
+        max_workers = getattr(settings, 'GEOCODE_MAX_WORKERS', 8)
+    if timeout is None:
+        timeout = getattr(settings, 'GEOCODE_TIMEOUT', 10)
+
+    # Cache lookups and writes stay on the calling thread; workers only do HTTP
+    addresses = [geocode_cache.get_cached_address(coordinates) for coordinates in coordinates_list]
+    misses = {}
+    for i, coordinates in enumerate(coordinates_list):
+        if addresses[i] is None:
+            misses.setdefault(geocode_cache.bucket_key(coordinates), []).append(i)
+    if not misses:
+        return addresses
+
+    provider = get_provider()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(misses))))
+    futures = {
+        # Each worker runs in a copy of this context so its calls count towards the current request
+        key: executor.submit(contextvars.copy_context().run, lookup_address, provider, coordinates_list[indexes[0]])
+        for key, indexes in misses.items()
+    }
+    wait(futures.values(), timeout=timeout)
+    # Hard deadline: queued lookups are dropped and running ones are not waited for
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for key, future in futures.items():
+        indexes = misses[key]
+        coordinates = coordinates_list[indexes[0]]
+        address = None
+        if not future.done():
+            logger.warning(f"get_addresses_from_coordinates - Lookup timed out for coordinates: {coordinates}")
+            future.add_done_callback(partial(remember_late_address, coordinates))
+        elif future.cancelled():
+            logger.warning(f"get_addresses_from_coordinates - Lookup skipped after timeout for coordinates: {coordinates}")
+        elif not future.exception():
+            address = future.result()
+        if address is not None:
+            geocode_cache.store_address(coordinates, address)
+        for i in indexes:
+            addresses[i] = address if address is not None else ADDRESS_NOT_FOUND
+    return addresses
+
+def remember_late_address(coordinates, future):
+    """Done callback of a lookup that outlived the deadline: keeps its address in the in-process cache
+    (runs on the worker thread, which has no business opening a database connection)"""
+    if not future.cancelled() and not future.exception() and future.result() is not None:
+        geocode_cache.remember_address(coordinates, future.result())
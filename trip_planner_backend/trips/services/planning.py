@@ -0,0 +1,324 @@
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from trips import instrumentation
+from trips.models import LogEntry, Route, RouteSteps, Stop, Trip, resolve_stop_addresses
+from trips.serializers import LogEntrySerializer, TripSerializer, find_location_error
+from trips.services import mapbox_async
+from trips.services.mapbox_service import MapboxService, get_coordinates
+
+logger = logging.getLogger(__name__)
+
+
+class PlanningError(Exception):
+    """A planning step failed; payload and status_code describe the API error response"""
+    def __init__(self, message, status_code=400, **details):
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = {"error": message, **details}
+
+
+def get_route_points(trip):
+    """Validates the trip locations and returns (origin, destination, waypoints) as (lat, lng) tuples"""
+    # Validate required fields
+    required_fields = ['current_location', 'dropoff_location']
+    for field in required_fields:
+        if not getattr(trip, field):
+            logger.error(f"Missing required field {field} for trip {trip.id}")
+            raise PlanningError(f"Missing required location: {field}")
+
+    # Extract coordinates from location JSON
+    try:
+        origin = get_coordinates(trip.current_location)
+        destination = get_coordinates(trip.dropoff_location)
+        waypoints = [get_coordinates(trip.pickup_location)] if trip.pickup_location else None
+    except Exception as e:
+        logger.error(f"Failed to extract coordinates for trip {trip.id}: {str(e)}")
+        logger.error(f"Current location data: {trip.current_location}")
+        logger.error(f"Dropoff location data: {trip.dropoff_location}")
+        logger.error(f"Pickup location data: {trip.pickup_location}")
+        raise PlanningError(str(e))
+
+    logger.info(f"Processing route for trip {trip.id}")
+    logger.debug(f"Origin coordinates: {origin}")
+    logger.debug(f"Destination coordinates: {destination}")
+    logger.debug(f"Waypoint coordinates: {waypoints}")
+    return origin, destination, waypoints
+
+
+def route_failed(trip, error, origin, destination, waypoints):
+    logger.error(f"Mapbox API call failed for trip {trip.id}: {str(error)}")
+    return PlanningError(
+        f"Route calculation failed: {str(error)}",
+        origin=origin,
+        destination=destination,
+        waypoints=waypoints,
+    )
+
+
+@transaction.atomic
+def save_route(trip, route_data):
+    """Updates the trip estimates and stores the route in one transaction"""
+    # Update trip with route details
+    try:
+        trip.estimated_distance = route_data.get('distance', 0) / 1609.34
+        trip.estimated_duration = route_data.get('duration', 0) / 3600
+        trip.save()
+    except Exception as e:
+        logger.error(f"Failed to update trip {trip.id} with route details: {str(e)}")
+        raise
+
+    # Save route data
+    try:
+        route, _ = Route.objects.update_or_create(
+            trip=trip,
+            defaults={"route_data": route_data}
+        )
+    except Exception as e:
+        logger.error(f"Failed to save route data for trip {trip.id}: {str(e)}")
+        raise
+    return route
+
+
+def route_summary(trip, route):
+    """Response body for a calculated route"""
+    logger.info(f"Route calculated for trip {trip.id}")
+    return {
+        "message": "Route calculated successfully",
+        "route": {
+            "id": route.id,
+            "version": route.version,
+            "distance": route.distance,
+            "duration": route.duration,
+            "updated_at": route.updated_at.isoformat(),
+        },
+        "trip": {
+            "id": trip.id,
+            "estimated_distance": trip.estimated_distance,
+            "estimated_duration": trip.estimated_duration,
+            "status": trip.status,
+            "stop_count": trip.stops.count(),
+        }
+    }
+
+
+def calculate_route(trip):
+    """Calls mapbox API to calculate the route, updates the trip estimates and regenerates its stops
+    Returns a summary with the route version
+    Raises PlanningError when the trip cannot be routed"""
+    origin, destination, waypoints = get_route_points(trip)
+    try:
+        with instrumentation.phase('routing'):
+            route_data = MapboxService.get_route(origin, destination, waypoints=waypoints)
+    except Exception as e:
+        raise route_failed(trip, e, origin, destination, waypoints)
+
+    try:
+        with instrumentation.phase('routing'):
+            route = save_route(trip, route_data)
+        with instrumentation.phase('stop_generation'):
+            trip.generate_stops()
+    except Exception as e:
+        logger.error(f"Unexpected error for trip {trip.id}: {str(e)}")
+        raise PlanningError(str(e))
+    return route_summary(trip, route)
+
+
+async def calculate_route_async(trip):
+    """Async version of calculate_route for ASGI deployments
+    The Directions request and the stop geocoding are awaited on the event loop;
+    only the database work runs in the sync thread"""
+    origin, destination, waypoints = get_route_points(trip)
+    try:
+        with instrumentation.phase('routing'):
+            route_data = await mapbox_async.get_route(origin, destination, waypoints=waypoints)
+    except Exception as e:
+        raise route_failed(trip, e, origin, destination, waypoints)
+
+    try:
+        with instrumentation.phase('routing'):
+            route = await sync_to_async(save_route)(trip, route_data)
+        with instrumentation.phase('stop_generation'):
+            # Same steps as Trip.generate_stops, with the geocoding awaited
+            changes = await sync_to_async(trip.plan_stop_changes)()
+            pending = changes.unresolved
+            addresses = await mapbox_async.get_addresses_from_coordinates([stop.location['coordinates'] for stop in pending])
+            for stop, address in zip(pending, addresses):
+                stop.location['address'] = address
+            await sync_to_async(trip.apply_stop_changes)(changes)
+    except Exception as e:
+        logger.error(f"Unexpected error for trip {trip.id}: {str(e)}")
+        raise PlanningError(str(e))
+    return await sync_to_async(route_summary)(trip, route)
+
+
+def generate_logs(trip):
+    """Generates log entries for the trip based on stops and route data
+    Returns the serialized logs
+    Raises PlanningError when no logs can be generated"""
+    try:
+        # Check if route data exists
+        if not Route.objects.filter(trip=trip).exists():
+            raise PlanningError("Route data not found. Please calculate route first.")
+
+        logger.info(f"Generating logs for trip {trip.id}")
+
+        with instrumentation.phase('log_generation'):
+            try:
+                # Try detailed log generation first
+                logs = trip.generate_log_entries_detailed()
+                logger.info(f"Generated detailed logs for trip {trip.id}")
+            except Exception as e:
+                logger.warning(f"Detailed log generation failed for trip {trip.id}: {str(e)}")
+                # Fallback to simpler log generation
+                try:
+                    logs = trip.generate_log_entries()
+                    logger.info(f"Generated simple logs for trip {trip.id}")
+                except Exception as inner_e:
+                    logger.error(f"Simple log generation failed for trip {trip.id}: {str(inner_e)}")
+                    raise PlanningError(f"Log generation failed: {str(inner_e)}", status_code=500)
+
+        if not logs:
+            raise PlanningError("No logs were generated")
+
+        with instrumentation.phase('serialization'):
+            serialized_logs = LogEntrySerializer(logs, many=True).data
+    except PlanningError:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error in generate_logs for trip {trip.id}: {str(e)}")
+        raise PlanningError("An unexpected error occurred while generating logs", status_code=500)
+
+    logger.info(f"Generated {len(logs)} logs for trip {trip.id}")
+    return {
+        "message": "Logs generated successfully",
+        "logs": serialized_logs
+    }
+
+
+def fetch_route(location_data):
+    """Fetches the Mapbox route for validated trip locations (no database access, safe on worker threads)"""
+    origin = get_coordinates(location_data['current_location'])
+    destination = get_coordinates(location_data['dropoff_location'])
+    waypoints = [get_coordinates(location_data['pickup_location'])] if location_data.get('pickup_location') else None
+    try:
+        return MapboxService.get_route(origin, destination, waypoints=waypoints)
+    except Exception as e:
+        raise PlanningError(f"Route calculation failed: {str(e)}")
+
+
+def plan_trips(trips_data, with_logs=True, max_workers=None):
+    """Creates and plans many trips at once
+    Validates every trip, fetches the routes concurrently on a bounded worker pool, geocodes
+    each trip's generated stops in one call and writes trips, routes, stops and logs with bulk inserts.
+    Only trips that plan successfully are saved.
+    Returns one result per input trip, in order, with either the planned trip or its errors"""
+    results = [None] * len(trips_data)
+
+    # Validate everything up front
+    valid = []
+    for index, data in enumerate(trips_data):
+        # Same checks as creating a single trip
+        location_error = find_location_error(data)
+        if location_error is not None:
+            field, message = location_error
+            results[index] = {"index": index, "errors": {field: [message]}}
+            continue
+        serializer = TripSerializer(data=data)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {"index": index, "errors": serializer.errors}
+
+    # Routing is network bound: fan it out
+    max_workers = max_workers or getattr(settings, 'BATCH_MAX_WORKERS', 8)
+    routes = {}
+    with instrumentation.phase('routing'), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Workers run in copies of this context so their calls count towards the current request
+        futures = {executor.submit(contextvars.copy_context().run, fetch_route, data): index for index, data in valid}
+        for future, index in futures.items():
+            try:
+                routes[index] = future.result()
+            except Exception as e:
+                logger.error(f"Batch route calculation failed for trip {index}: {str(e)}")
+                results[index] = {"index": index, "errors": {"route": [str(e)]}}
+
+    # Build everything in memory; addresses are resolved in one batch afterwards
+    planned = []
+    for index, data in valid:
+        if index not in routes:
+            continue
+        route_data = routes[index]
+        trip = Trip(**data)
+        trip.estimated_distance = route_data.get('distance', 0) / 1609.34
+        trip.estimated_duration = route_data.get('duration', 0) / 3600
+        route = Route(trip=trip, route_data=route_data)
+        route.build_derived_fields()
+        try:
+            with instrumentation.phase('stop_generation'):
+                stops = trip.build_stops(resolve_addresses=False)
+        except Exception as e:
+            logger.error(f"Batch stop generation failed for trip {index}: {str(e)}")
+            results[index] = {"index": index, "errors": {"stops": [str(e)]}}
+            continue
+        planned.append((index, trip, route, stops))
+
+    # One geocoding call per trip, so each gets the full GEOCODE_TIMEOUT rather than sharing one
+    # across the batch; placeholders left behind are retried when the trip's route is recalculated
+    with instrumentation.phase('stop_generation'):
+        for _, _, _, stops in planned:
+            resolve_stop_addresses(stops)
+
+    with transaction.atomic():
+        Trip.objects.bulk_create([trip for _, trip, _, _ in planned])
+
+        # Logs need the saved trips (they start at created_at); a trip whose logs fail is
+        # reported and deleted again before anything else of it is written
+        logs_by_trip = {}
+        if with_logs:
+            with instrumentation.phase('log_generation'):
+                for index, trip, _, stops in planned:
+                    try:
+                        try:
+                            logs = trip.build_log_entries_detailed(stops)
+                        except Exception as e:
+                            logger.warning(f"Detailed log generation failed for batch trip {index}: {str(e)}")
+                            logs = trip.build_log_entries()
+                        for log in logs:
+                            log.compute_duration()
+                    except Exception as e:
+                        logger.error(f"Batch log generation failed for trip {index}: {str(e)}")
+                        results[index] = {"index": index, "errors": {"logs": [str(e)]}}
+                        continue
+                    logs_by_trip[index] = logs
+            failed = [trip.pk for index, trip, _, _ in planned if results[index] is not None]
+            if failed:
+                Trip.objects.filter(pk__in=failed).delete()
+                planned = [item for item in planned if results[item[0]] is None]
+
+        for _, trip, route, stops in planned:
+            route.trip = trip # Picks up the primary key assigned by bulk_create
+            for stop in stops:
+                stop.trip = trip
+        Route.objects.bulk_create([route for _, _, route, _ in planned])
+        RouteSteps.objects.bulk_create([RouteSteps(route=route, legs=route.get_legs()) for _, _, route, _ in planned])
+        Stop.objects.bulk_create([stop for _, _, _, stops in planned for stop in stops])
+        LogEntry.objects.bulk_create([log for logs in logs_by_trip.values() for log in logs])
+
+    for index, trip, route, stops in planned:
+        results[index] = {
+            "index": index,
+            "id": trip.id,
+            "estimated_distance": trip.estimated_distance,
+            "estimated_duration": trip.estimated_duration,
+            "route": {"id": route.id, "version": route.version},
+            "stop_count": len(stops),
+            "log_entry_count": len(logs_by_trip.get(index, [])),
+        }
+    logger.info(f"Planned {len(planned)} of {len(trips_data)} batch trips")
+    return results
@@ -0,0 +1,61 @@
+import asyncio
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+# Short names accepted by settings.ROUTING_PROVIDER besides a dotted class path
+PROVIDERS = {
+    'mapbox': 'trips.services.mapbox_provider.MapboxProvider',
+    'local': 'trips.services.local_provider.LocalProvider',
+}
+
+
+class RoutingProvider(ABC):
+    """Interface of the routing and reverse geocoding backends
+    get_route returns a route in Mapbox Directions response shape (distance in meters,
+    duration in seconds, GeoJSON geometry, legs) and reverse_geocode an address or None.
+    Providers do no caching; MapboxService and the geocode cache sit in front of them.
+    The async methods default to running the sync ones on a thread; a provider missing
+    get_route or reverse_geocode cannot be instantiated."""
+    name = None
+
+    @abstractmethod
+    def get_route(self, origin, destination, waypoints=None):
+        """Args:
+            :param origin: Tuple of (lat, lng) coordinates for origin
+            :param destination: Tuple of (lat, lng) coordinates for destination
+            :param waypoints: List of Tuple of (lat, lng) for intermediate stops
+            :return: Dictionary with route data or raises exception if not found
+        """
+
+    @abstractmethod
+    def reverse_geocode(self, coordinates):
+        """Returns the address of {"lat": ..., "lng": ...}, or None if the lookup failed or found nothing"""
+
+    async def get_route_async(self, origin, destination, waypoints=None):
+        return await asyncio.to_thread(self.get_route, origin, destination, waypoints)
+
+    async def reverse_geocode_async(self, coordinates):
+        return await asyncio.to_thread(self.reverse_geocode, coordinates)
+
+
+_providers = {}
+
+
+def get_provider():
+    """Returns the provider selected by settings.ROUTING_PROVIDER ("mapbox", "local" or a dotted path)"""
+    path = getattr(settings, 'ROUTING_PROVIDER', 'mapbox')
+    provider = _providers.get(path)
+    if provider is None:
+        provider = _providers[path] = import_string(PROVIDERS.get(path, path))()
+    return provider
+
+
+@receiver(setting_changed)
+def reset_providers(setting, **kwargs):
+    """Drops the cached providers when override_settings changes their configuration"""
+    if setting == 'ROUTING_PROVIDER' or setting.startswith('LOCAL_PROVIDER_'):
+        _providers.clear()
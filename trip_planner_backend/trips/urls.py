@@ -1,13 +1,25 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework import routers
-from .views import TripViewSet, StopViewSet, LogEntryViewSet, RouteViewSet
+from . import async_views
+from .views import TripViewSet, StopViewSet, LogEntryViewSet, RouteViewSet, JobViewSet, ProfileRecordViewSet, metrics
 
 router = routers.DefaultRouter()
 router.register(r'trips', TripViewSet, 'trip')
 router.register(r'stops', StopViewSet, 'stop')
 router.register(r'log-entries', LogEntryViewSet, 'log-entry')
 router.register(r'routes', RouteViewSet, 'route')
+router.register(r'jobs', JobViewSet, 'job')
+router.register(r'profiles', ProfileRecordViewSet, 'profile')
 
 urlpatterns = [
+    path('metrics/', metrics, name='metrics'),
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
+
+if getattr(settings, 'ASYNC_VIEWS', False):
+    # Serve the Mapbox-bound actions with async handlers (requires an ASGI server)
+    urlpatterns = [
+        path('trips/<int:pk>/calculate-route/', async_views.calculate_route, name='trip-calculate-route'),
+        path('trips/<int:pk>/generate-logs/', async_views.generate_logs, name='trip-generate-logs'),
+    ] + urlpatterns
@@ -1,4 +1,4 @@
-from math import radians, sin, cos, sqrt, atan2
+from trips import geometry
 
 def calculate_distance(coord1, coord2):
     """
@@ -9,19 +9,13 @@ def calculate_distance(coord1, coord2):
     """
     lat1, lon1 = coord1
     lat2, lon2 = coord2
+    return float(geometry.haversine((lon1, lat1), (lon2, lat2))) / 1000
 
-    # Convert latitude and longitude to radians
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-
-    # Radius of earth in kilometers. Use 3959 for miles
-    radius = 6371
-
-    # Calculate the result
-    distance = radius * c
-    return distance
\ No newline at end of file
+def calculate_distances(coords1, coords2):
+    """
+    Vectorized calculate_distance over matching rows of two sequences of (latitude, longitude).
+    :return: NumPy array of distances in kilometers.
+    """
+    coords1 = geometry.to_array(coords1)[:, ::-1]
+    coords2 = geometry.to_array(coords2)[:, ::-1]
+    return geometry.haversine(coords1, coords2) / 1000
@@ -1,18 +1,199 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
-from trips.models import Trip, Stop, LogEntry, Route
-from trips.serializers import TripSerializer, StopSerializer, LogEntrySerializer, RouteSerializer, GenerateLogsSerializer
-from trips.services.mapbox_service import MapboxService, get_coordinates
+from trips import instrumentation, profiling
+from trips.models import Trip, Stop, LogEntry, Route, Job, ProfileRecord
+from trips.pagination import StandardResultsSetPagination
+from trips.serializers import TripSerializer, TripListSerializer, StopSerializer, LogEntrySerializer, RouteSerializer, JobSerializer, ProfileRecordSerializer, BatchTripsSerializer, GenerateLogsSerializer, PreviewLogsSerializer, DutySegmentSerializer, find_location_error
+from trips.services import jobs, planning
+from trips.services.planning import PlanningError
 from datetime import timedelta
+import hashlib
+import logging
 
+logger = logging.getLogger(__name__)
 
-class TripViewSet(viewsets.ModelViewSet):
+
+def count_subquery(model):
+    """Annotation counting the rows of model that belong to the outer trip"""
+    counts = model.objects.filter(trip=OuterRef('pk')).order_by().values('trip').annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class DynamicFieldsViewMixin:
+    """Supports ?fields= and ?expand= on read requests
+    Passes them to serializers using DynamicFieldsMixin and narrows the queryset to match"""
+
+    required_columns = () # Columns the view reads itself, never deferred
+
+    def get_query_list(self, name):
+        """Parses a comma separated query parameter, returning None when it is absent"""
+        value = self.request.query_params.get(name) if self.request.method == 'GET' else None
+        if value is None:
+            return None
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request is not None and self.request.method == 'GET':
+            kwargs.setdefault('fields', self.get_query_list('fields'))
+            kwargs.setdefault('expand', self.get_query_list('expand'))
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer_class = self.get_serializer_class()
+        if self.action in ('list', 'retrieve') and hasattr(serializer_class, 'setup_queryset'):
+            queryset = serializer_class.setup_queryset(queryset, self.get_query_list('fields'), self.get_query_list('expand'), self.required_columns)
+        return queryset
+
+class ConditionalGetViewMixin:
+    """Adds ETag and Last-Modified headers to list and retrieve responses and answers
+    If-None-Match / If-Modified-Since with 304 Not Modified before serializing anything
+    Relies on the model's updated_at, which covers related rows shown in the response"""
+
+    required_columns = ('updated_at',)
+
+    def get_etag(self, version):
+        """Weak ETag for the version of the data, varying with the query string and format"""
+        key = f"{self.request.get_full_path()}|{self.request.accepted_media_type}|{version}"
+        return f'W/"{hashlib.md5(key.encode()).hexdigest()}"'
+
+    def conditional_response(self, version, last_modified, get_data):
+        """Returns 304 when the client's copy is current, otherwise a response with get_data()"""
+        headers = {
+            "ETag": self.get_etag(version),
+            "Cache-Control": "private, no-cache", # Always revalidate, usually getting a 304
+        }
+        if last_modified is not None:
+            headers["Last-Modified"] = http_date(last_modified.timestamp())
+        not_modified = get_conditional_response(
+            self.request,
+            etag=headers["ETag"],
+            last_modified=int(last_modified.timestamp()) if last_modified else None,
+        )
+        if not_modified is not None:
+            for name, value in headers.items():
+                not_modified[name] = value
+            return not_modified
+        with instrumentation.phase('serialization'):
+            data = get_data()
+        return Response(data, headers=headers)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.conditional_response(
+            instance.updated_at.isoformat(),
+            instance.updated_at,
+            lambda: self.get_serializer(instance).data,
+        )
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        state = queryset.order_by().aggregate(count=Count('pk'), last_modified=Max('updated_at'))
+        last_modified = state['last_modified']
+        version = f"{state['count']}:{last_modified.isoformat() if last_modified else ''}"
+        return self.conditional_response(version, last_modified, lambda: self.get_list_data(queryset))
+
+    def get_list_data(self, queryset):
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data).data
+        return self.get_serializer(queryset, many=True).data
+
+class ProfilingViewMixin:
+    """Profiles actions when staff ask for it with ?profile=cprofile|sampling (or the X-Profile
+    header), and samples every action when settings.PROFILE_SLOW_THRESHOLD is set, keeping
+    the profiles of requests slower than that many seconds
+    Stored profiles are listed at /api/profiles/ and the response carries X-Profile-Id"""
+
+    profile = None
+    profile_trigger = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        mode = profiling.requested_mode(request)
+        if mode:
+            self.profile, self.profile_trigger = profiling.Profile(mode).start(), 'requested'
+        elif getattr(settings, 'PROFILE_SLOW_THRESHOLD', None) is not None:
+            self.profile, self.profile_trigger = profiling.Profile('sampling').start(), 'slow'
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.profile is None:
+            return response
+        profile = self.profile.stop()
+        self.profile = None
+        if self.profile_trigger == 'requested' or profile.duration >= settings.PROFILE_SLOW_THRESHOLD:
+            pk = self.kwargs.get('pk')
+            trip_id = pk if pk and Trip.objects.filter(pk=pk).exists() else None
+            try:
+                record = profiling.store_profile(profile, request, self.action, trip_id, self.profile_trigger, response.status_code)
+            except Exception as e:
+                # A profile that can't be saved must not turn the response into an error
+                logger.exception(f"Could not store the {profile.mode} profile of {request.method} {request.path}: {str(e)}")
+            else:
+                response['X-Profile-Id'] = str(record.id)
+        return response
+
+class RouteDetailViewMixin:
+    """Supports ?detail=low|medium|full to pick the route geometry resolution
+    The parameter is only read (and validated) by actions that render the route"""
+
+    def get_route_detail(self):
+        detail = self.request.query_params.get('detail', 'full')
+        if detail not in Route.DETAIL_LEVELS:
+            raise ValidationError({"detail": f"Must be one of: {', '.join(Route.DETAIL_LEVELS)}"})
+        return detail
+
+    def renders_route(self):
+        """True when the current action serializes route geometry"""
+        return self.action in ('list', 'retrieve')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.renders_route():
+            context['detail'] = self.get_route_detail()
+        return context
+
+class TripViewSet(ProfilingViewMixin, ConditionalGetViewMixin, RouteDetailViewMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     """API endpoint that allows trips to be viewed, created, updated, or deleted"""
     queryset = Trip.objects.all().order_by('-created_at')
     serializer_class = TripSerializer
+    pagination_class = StandardResultsSetPagination
+
+    def get_queryset(self):
+        """Annotates counts for the compact list; nested rows are prefetched per ?expand="""
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            fields = self.get_query_list('fields')
+            if fields is None or 'stop_count' in fields:
+                queryset = queryset.annotate(stop_count=count_subquery(Stop))
+            if fields is None or 'log_entry_count' in fields:
+                queryset = queryset.annotate(log_entry_count=count_subquery(LogEntry))
+        return queryset
+
+    def renders_route(self):
+        # The route is only nested when expanded
+        if not super().renders_route():
+            return False
+        serializer_class = self.get_serializer_class()
+        return 'route' in serializer_class.resolve_expand(self.get_query_list('expand'), self.get_query_list('fields'))
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return TripListSerializer
+        return super().get_serializer_class()
 
     def create(self, request, *args, **kwargs):
         """Overrides default create to validate location data"""
@@ -24,21 +205,9 @@ class TripViewSet(viewsets.ModelViewSet):
 
     def _validate_and_create_or_update(self, request, is_update=False):
         """Validates location data and creates or updates the trip"""
-        location_fields = ['current_location', 'pickup_location', 'dropoff_location']
-        for field in location_fields:
-            location_data = request.data.get(field)
-            if location_data and not isinstance(location_data, dict):
-                return Response(
-                    {"error": f"Invalid format for {field}. Expected a JSON object."},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            if location_data:
-                coordinates = location_data.get('coordinates')
-                if not location_data.get('address') or not isinstance(coordinates, dict) or 'lat' not in coordinates or 'lng' not in coordinates:
-                    return Response(
-                        {"error": f"Invalid {field} format. Expected {{\"address\": \"...\", \"coordinates\": {{\"lat\": ..., \"lng\": ...}}}}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+        location_error = find_location_error(request.data)
+        if location_error is not None:
+            return Response({"error": location_error[1]}, status=status.HTTP_400_BAD_REQUEST)
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         if is_update:
@@ -51,77 +220,34 @@ class TripViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], url_path='calculate-route')
     def calculate_route(self, request, pk=None):
         """Calls mapbox API to calculate route details
-        This should update the Trip instance with estimated distance and duration"""
+        This should update the Trip instance with estimated distance and duration
+        Returns a summary with the route version; fetch the route itself from /api/routes/?trip=
+        (with ?detail= and If-None-Match) and the stops from the trip endpoint
+        With ?async=true the work is queued and a job is returned (202)"""
         trip = self.get_object()
-
-        # Validate required fields
-        required_fields = ['current_location', 'dropoff_location']
-        for field in required_fields:
-            if not getattr(trip, field):
-                print(f"ERROR: Missing required field {field} for trip {trip.id}")
-                return Response(
-                    {"error": f"Missing required location: {field}"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
+        if self.wants_async():
+            return self.enqueue_job(trip, 'calculate_route')
         try:
-            # Extract coordinates from location JSON
-            try:
-                origin = get_coordinates(trip.current_location)
-                destination = get_coordinates(trip.dropoff_location)
-                waypoints = [get_coordinates(trip.pickup_location)] if trip.pickup_location else None
-            except Exception as e:
-                print(f"ERROR: Failed to extract coordinates for trip {trip.id}: {str(e)}")
-                print(f"Current location data: {trip.current_location}")
-                print(f"Dropoff location data: {trip.dropoff_location}")
-                print(f"Pickup location data: {trip.pickup_location}")
-                raise
-
-            print(f"INFO: Processing route for trip {trip.id}")
-            print(f"Origin coordinates: {origin}")
-            print(f"Destination coordinates: {destination}")
-            print(f"Waypoint coordinates: {waypoints}")
-            
-            try:
-                route_data = MapboxService.get_route(origin, destination, waypoints=waypoints)
-            except Exception as e:
-                print(f"ERROR: Mapbox API call failed for trip {trip.id}: {str(e)}")
-                return Response({
-                    "error": f"Route calculation failed: {str(e)}",
-                    "origin": origin,
-                    "destination": destination,
-                    "waypoints": waypoints
-                }, status=status.HTTP_400_BAD_REQUEST)
-
-            # Update trip with route details
-            try:
-                trip.estimated_distance = route_data.get('distance', 0) / 1609.34
-                trip.estimated_duration = route_data.get('duration', 0) / 3600
-                trip.save()
-            except Exception as e:
-                print(f"ERROR: Failed to update trip {trip.id} with route details: {str(e)}")
-                raise
+            return Response(planning.calculate_route(trip), status=status.HTTP_200_OK)
+        except PlanningError as e:
+            return Response(e.payload, status=e.status_code)
 
-            # Save route data
-            try:
-                Route.objects.update_or_create(
-                    trip=trip,
-                    defaults={"route_data": route_data}
-                )
-                trip.generate_stops()
-            except Exception as e:
-                print(f"ERROR: Failed to save route data for trip {trip.id}: {str(e)}")
-                raise
-
-            print(f"SUCCESS: Route calculated for trip {trip.id}")
-            return Response({
-                "message": "Route calculated successfully",
-                "route_data": route_data,
-                "trip": TripSerializer(trip).data
-            }, status=status.HTTP_200_OK)
-        except Exception as e:
-            print(f"ERROR: Unexpected error for trip {trip.id}: {str(e)}")
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=['post'], serializer_class=BatchTripsSerializer, url_path='batch')
+    def batch(self, request):
+        """Creates and plans many trips in one request: route, stops and (optionally) logs
+        Body: {"trips": [<trip>, ...], "generate_logs": true}
+        Returns one result per trip, in order, with the planned trip or its errors
+        Endpoint: POST /api/trips/batch/
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = planning.plan_trips(serializer.validated_data['trips'], with_logs=serializer.validated_data['generate_logs'])
+        failed = sum(1 for result in results if 'errors' in result)
+        return Response({
+            "created": len(results) - failed,
+            "failed": failed,
+            "results": results,
+        }, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['get'], url_path='validate')
     def validate_trip(self, request, pk=None):
@@ -137,9 +263,8 @@ class TripViewSet(viewsets.ModelViewSet):
 
         # Validate daily driving using log entries
         # Assuming log entries have been generated 
-        log_dates = trip.log_entries.values_list('date', flat=True).distinct()
-        for log_date in log_dates:
-            totals = LogEntry.compute_daily_totals(trip, log_date)
+        daily_totals = trip.log_entries.daily_totals()
+        for log_date, totals in daily_totals.items():
             driving_duration = totals.get('status_durations', {}).get('driving', timedelta(0))
             if driving_duration > timedelta(hours=11):
                 warnings.append(
@@ -161,97 +286,169 @@ class TripViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], serializer_class=GenerateLogsSerializer, url_path='generate-logs')
     def generate_logs(self, request, pk=None):
         """Generates log entries for the trip based on stops and route data
+        With ?async=true the work is queued and a job is returned (202)
         Endpoint: POST /api/trips/{trip_id}/generate-logs/
         """
+        trip = self.get_object()
+        if self.wants_async():
+            return self.enqueue_job(trip, 'generate_logs')
         try:
-            trip = self.get_object()
-            
-            # Check if trip exists
-            if not trip:
-                return Response(
-                    {"error": "Trip not found"}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
+            return Response(planning.generate_logs(trip), status=status.HTTP_200_OK)
+        except PlanningError as e:
+            return Response(e.payload, status=e.status_code)
 
-            # Check if route data exists
-            if not hasattr(trip, 'route') or not trip.route:
-                return Response(
-                    {"error": "Route data not found. Please calculate route first."}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+    def wants_async(self):
+        return self.request.query_params.get('async', '').lower() in ('1', 'true', 'yes')
 
-            print(f"INFO: Generating logs for trip {trip.id}")
-            
-            try:
-                # Try detailed log generation first
-                logs = trip.generate_log_entries_detailed()
-                print(f"INFO: Generated detailed logs for trip {trip.id}")
-            except Exception as e:
-                print(f"WARNING: Detailed log generation failed for trip {trip.id}: {str(e)}")
-                # Fallback to simpler log generation
-                try:
-                    logs = trip.generate_log_entries()
-                    print(f"INFO: Generated simple logs for trip {trip.id}")
-                except Exception as inner_e:
-                    print(f"ERROR: Simple log generation failed for trip {trip.id}: {str(inner_e)}")
-                    return Response(
-                        {"error": f"Log generation failed: {str(inner_e)}"}, 
-                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                    )
-            
-            if not logs:
-                return Response(
-                    {"error": "No logs were generated"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+    def enqueue_job(self, trip, kind):
+        """Queues a planning job and answers 202 with the job to poll"""
+        job = jobs.enqueue(trip, kind)
+        location = reverse('job-detail', args=[job.pk], request=self.request)
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED, headers={"Location": location})
 
-            serialized_logs = LogEntrySerializer(logs, many=True).data
-            print(f"SUCCESS: Generated {len(logs)} logs for trip {trip.id}")
-            
-            return Response({
-                "message": "Logs generated successfully",
-                "logs": serialized_logs
-            }, status=status.HTTP_200_OK)
+    @action(detail=True, methods=['post'], serializer_class=PreviewLogsSerializer, url_path='preview-logs')
+    def preview_logs(self, request, pk=None):
+        """Previews the HOS schedule for the trip without saving any log entries
+        Optional overrides: start_time, current_cycle_hours and extra_rest_stops
+        ([{"after_order": ..., "duration_hours": ...}])
+        Endpoint: POST /api/trips/{trip_id}/preview-logs/
+        """
+        trip = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        overrides = serializer.validated_data
 
-        except Exception as e:
-            print(f"ERROR: Unexpected error in generate_logs for trip {pk}: {str(e)}")
+        stops = list(trip.stops.order_by('order'))
+        if not stops:
             return Response(
-                {"error": "An unexpected error occurred while generating logs"}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "No stops found. Please calculate route first."},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-class StopViewSet(viewsets.ModelViewSet):
+        # Extra rest stops are taken at the location of the stop they follow, so they add no driving
+        for extra in sorted(overrides.get('extra_rest_stops', []), key=lambda extra: extra['after_order'], reverse=True):
+            position = sum(1 for stop in stops if stop.order <= extra['after_order'])
+            anchor = stops[max(position - 1, 0)]
+            stops.insert(position, Stop(
+                trip=trip,
+                location=anchor.location,
+                stop_type='rest',
+                order=extra['after_order'],
+                duration=timedelta(hours=extra['duration_hours']),
+            ))
+
+        schedule = trip.build_log_schedule(
+            stops=stops,
+            start_time=overrides.get('start_time'),
+            cycle_hours=overrides.get('current_cycle_hours'),
+        )
+        segments = schedule.segments
+        hours_by_status = {}
+        for segment in segments:
+            hours_by_status[segment.status] = hours_by_status.get(segment.status, 0) + segment.duration.total_seconds() / 3600
+
+        return Response({
+            "timeline": DutySegmentSerializer(segments, many=True).data,
+            "summary": {
+                "start_time": segments[0].start if segments else None,
+                "end_time": schedule.end,
+                "hours_by_status": hours_by_status,
+                "cycle_hours_at_end": schedule.cycle_hours,
+            }
+        }, status=status.HTTP_200_OK)
+
+class StopViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet):
     """API endpoint for managing stops within a trip"""
     queryset = Stop.objects.all().order_by('order')
     serializer_class = StopSerializer
+    pagination_class = StandardResultsSetPagination
 
     def get_queryset(self):
         """Filters stops based on trip id"""
+        queryset = super().get_queryset()
         trip_id = self.request.query_params.get('trip')
         if trip_id:
-            return self.queryset.filter(trip__id=trip_id)
-        return self.queryset
+            return queryset.filter(trip__id=trip_id)
+        return queryset
 
-class LogEntryViewSet(viewsets.ModelViewSet):
+class LogEntryViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet):
     """API endpoint for managing log entries (ELD logs) within a trip"""
-    queryset = LogEntry.objects.all().order_by('date')
+    queryset = LogEntry.objects.all().order_by('date', 'start_time')
     serializer_class = LogEntrySerializer
+    pagination_class = StandardResultsSetPagination
 
     def get_queryset(self):
         """Filters log entries based on trip id"""
+        queryset = super().get_queryset()
         trip_id = self.request.query_params.get('trip')
         if trip_id:
-            return self.queryset.filter(trip__id=trip_id)
-        return self.queryset
+            return queryset.filter(trip__id=trip_id)
+        return queryset
 
-class RouteViewSet(viewsets.ModelViewSet):
+class RouteViewSet(ConditionalGetViewMixin, RouteDetailViewMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     """Accessing stored route data"""
     queryset = Route.objects.all().order_by('-created_at')
     serializer_class = RouteSerializer
+    pagination_class = StandardResultsSetPagination
 
     def get_queryset(self):
         """Filters routes based on trip id"""
+        queryset = super().get_queryset()
+        trip_id = self.request.query_params.get('trip')
+        if trip_id:
+            return queryset.filter(trip__id=trip_id)
+        return queryset
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Polling background planning jobs"""
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    pagination_class = StandardResultsSetPagination
+
+    def get_queryset(self):
+        """Filters jobs based on trip id"""
+        queryset = super().get_queryset()
         trip_id = self.request.query_params.get('trip')
         if trip_id:
-            return self.queryset.filter(trip__id=trip_id)
-        return self.queryset
\ No newline at end of file
+            return queryset.filter(trip__id=trip_id)
+        return queryset
+
+
+class ProfileRecordViewSet(viewsets.ReadOnlyModelViewSet):
+    """Profiles captured by ProfilingViewMixin (staff only)"""
+    queryset = ProfileRecord.objects.defer('data')
+    serializer_class = ProfileRecordSerializer
+    pagination_class = StandardResultsSetPagination
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        """Filters profiles based on trip id"""
+        queryset = super().get_queryset()
+        trip_id = self.request.query_params.get('trip')
+        if trip_id:
+            return queryset.filter(trip__id=trip_id)
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Returns the raw profile: a pstats file for cprofile (python -m pstats, snakeviz) or
+        collapsed stacks for sampling (flamegraph.pl, speedscope)
+        Endpoint: GET /api/profiles/{profile_id}/download/
+        """
+        record = get_object_or_404(ProfileRecord, pk=pk)
+        extension = 'prof' if record.mode == 'cprofile' else 'txt'
+        response = HttpResponse(bytes(record.data), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{record.id}.{extension}"'
+        return response
+
+
+def metrics(request):
+    """Process metrics in the Prometheus text format
+    Each worker process reports its own values, so scrape every process
+    When settings.METRICS_TOKEN is set the request needs "Authorization: Bearer <token>"
+    Endpoint: GET /api/metrics/
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(instrumentation.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')